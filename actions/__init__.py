@@ -3,7 +3,7 @@
 This module contains all the action handlers for different ComfyUI operations.
 """
 
-from .base_job import ComfyJob, Status
+from .base_job import ComfyJob, Status, JobTimeoutError, JobExecutionError, first_image, close_images
 from .dream import dream, DrawJob, extract_loras, round_to_multiple
 from .upscale import upscale, UpscaleJob
 
@@ -11,6 +11,10 @@ __all__ = [
     # Base classes
     'ComfyJob',
     'Status',
+    'JobTimeoutError',
+    'JobExecutionError',
+    'first_image',
+    'close_images',
     
     # Dream operations
     'dream',
@@ -1,13 +1,13 @@
 from collections.abc import Coroutine
-import io
-import json
 import logging
+import uuid
 import asyncio
-import time
 from enum import Enum
-from api.websocket_subsystem import add_client, remove_client, is_websocket_connected
-from api.comfy_api import get_history, queue_prompt, get_image
+from api.backend_pool import backend_pool, NoBackendAvailableError
+from api.job_scheduler import job_scheduler, Priority
 from api.job_tracker import job_tracker
+from settings import comfy_download_concurrency, comfy_job_timeouts
+from utils.image_utils import decode_preview_frame
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +20,23 @@ class Status(Enum):
     DONE = 5
 
 
+class JobTimeoutError(Exception):
+    """Raised when a job does not leave a stage before its deadline"""
+
+    def __init__(self, stage, timeout):
+        super().__init__(f"Job timed out while {stage} after {timeout:g} seconds")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class JobExecutionError(Exception):
+    """Raised when ComfyUI reports that a prompt failed or was interrupted"""
+
+    def __init__(self, reason):
+        super().__init__(f"ComfyUI could not run the job: {reason.rstrip('.')}")
+        self.reason = reason
+
+
 class BaseJob:
     """Base class for all job types"""
 
@@ -57,87 +74,139 @@ class BaseJob:
 class ComfyJob(BaseJob):
     """Base class for all ComfyUI job types"""
 
-    def __init__(self, prompt, progress_callback=None):
+    def __init__(self, prompt, progress_callback=None, user_id=None, guild_id=None, priority=Priority.INTERACTIVE):
         super().__init__(progress_callback)
         self.prompt = prompt
-        self.prompt_id = -1
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.priority = priority
+        # Generated up front so the websocket router can deliver messages for
+        # this prompt even if they arrive before the /prompt response.
+        self.prompt_id = str(uuid.uuid4())
+        self.backend = None
         self.msg = None
-        self.last_update = time.time()
         self.progress_image = None
+        self.started = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.error = None
 
     async def execute(self):
         """Main execution flow for ComfyUI jobs"""
         logger.info(f"ComfyUI job starting for prompt_id: {self.prompt_id}")
 
-        # Check if websocket is connected before proceeding
-        if not is_websocket_connected():
-            logger.error("Websocket is not connected, cannot process image generation")
-            raise RuntimeError("Websocket connection not available")
+        # Fail fast instead of queueing behind the scheduler with nowhere to run
+        if not backend_pool.is_available():
+            logger.error("No ComfyUI backend is available, cannot process image generation")
+            raise NoBackendAvailableError("No healthy ComfyUI backend available")
+
+        # Wait for the scheduler to give this job a submission slot
+        ticket = await job_scheduler.acquire(self.user_id, self.guild_id, self.priority)
+        try:
+            return await self._execute_on_backend()
+        finally:
+            job_scheduler.release(ticket)
+
+    async def _execute_on_backend(self):
+        # Pick the least loaded backend with a live websocket
+        self.backend = backend_pool.select()
+        logger.info(f"Using ComfyUI backend {self.backend.address}")
 
-        await add_client(self)
+        self.backend.running_jobs += 1
+        await self.backend.websocket.add_client(self)
         try:
+            await self.prepare()
             logger.info("Sending prompt to ComfyUI")
             await self.send_prompt()
             logger.info(f"Prompt sent, waiting for image. Prompt ID: {self.prompt_id}")
             await self.wait_for_image()
             logger.info("Image generation completed, retrieving images")
-            return await self.get_images()
+            return await self._wait_stage(self.get_images(), "fetching")
         except Exception as e:
             logger.error(f"Error in ComfyJob.execute(): {e}")
             raise
         finally:
-            await remove_client(self)
+            await self.backend.websocket.remove_client(self)
+            self.backend.running_jobs -= 1
+
+    async def prepare(self):
+        """Hook run once a backend is chosen, before the prompt is sent"""
 
     async def wait_for_image(self):
         """Wait for image generation to complete"""
-        while self.state != Status.IMAGE_READY:
-            await asyncio.sleep(0.5)
+        await self._wait_stage(self.started.wait(), "queued")
+        await self._wait_stage(self.finished.wait(), "running")
+        if self.error:
+            raise self.error
+
+    async def _wait_stage(self, awaitable, stage):
+        """Await a job stage, raising JobTimeoutError if its deadline passes"""
+        timeout = comfy_job_timeouts.get(stage)
+        try:
+            return await asyncio.wait_for(awaitable, timeout or None)
+        except asyncio.TimeoutError:
+            logger.error(f"Prompt {self.prompt_id} timed out while {stage}")
+            await self.cancel_prompt()
+            raise JobTimeoutError(stage, timeout)
+
+    async def cancel_prompt(self):
+        """Stop ComfyUI working on this prompt once nobody is waiting for it"""
+        try:
+            await self.backend.client.delete_queued([self.prompt_id])
+            if self.backend.websocket.executing_prompt_id == self.prompt_id:
+                await self.backend.client.interrupt(self.prompt_id)
+            logger.info(f"Cancelled prompt {self.prompt_id} on {self.backend.address}")
+        except Exception as e:
+            logger.warning(f"Unable to cancel prompt {self.prompt_id}: {e}")
 
     async def send_prompt(self):
         """Send prompt to ComfyUI queue"""
         try:
             logger.info(f"Queueing prompt: {self.prompt}")
-            prompt_id = await queue_prompt(self.prompt)
-            self.prompt_id = prompt_id["prompt_id"]
             self.state = Status.QUEUED
+            prompt_id = await self.backend.client.queue_prompt(self.prompt, self.prompt_id)
+            if prompt_id["prompt_id"] != self.prompt_id:
+                # Older ComfyUI versions ignore the requested prompt_id.
+                await self.backend.websocket.remove_client(self)
+                self.prompt_id = prompt_id["prompt_id"]
+                await self.backend.websocket.add_client(self)
             logger.info(f"Prompt queued successfully with ID: {self.prompt_id}")
         except Exception as e:
             logger.error(f"Failed to queue prompt: {e}")
             raise
 
-    async def on_message(self, ws_message):
-        """Handle websocket messages"""
+    async def on_message(self, message):
+        """Handle websocket messages routed to this job"""
         # Ignore all messages if we are not running.
         if self.state != Status.QUEUED and self.state != Status.RUNNING:
             return
 
-        logger.debug(f"Received websocket message: {type(ws_message)}")
-
         # Handle preview image.
-        if isinstance(ws_message, bytes) and self.state == Status.RUNNING:
-            image_buffer = ws_message[8:]
-            self.progress_image = io.BytesIO(image_buffer)
-            logger.debug("Received preview image")
+        if isinstance(message, bytes):
+            # Only the latest frame is kept; it is encoded when shown.
+            if self.state == Status.RUNNING and self.progress_callback:
+                frame = decode_preview_frame(message)
+                if frame is not None:
+                    self.progress_image = frame
+            return
 
         # Handle normal messages
-        if isinstance(ws_message, str):
-            try:
-                message = json.loads(ws_message)
-                data = message["data"]
-                logger.debug(f"Processing message type: {message.get('type', 'unknown')}")
+        try:
+            data = message["data"]
+            logger.debug(f"Processing message type: {message.get('type', 'unknown')}")
 
-                if message["type"] == "execution_start":
-                    await self.on_execution_start(data)
+            if message["type"] == "execution_start":
+                await self.on_execution_start(data)
 
-                if message["type"] == "executing":
-                    await self.on_executing(data)
+            if message["type"] == "executing":
+                await self.on_executing(data)
 
-                if message["type"] == "progress":
-                    await self.on_progress(data)
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse websocket message: {e}")
-            except Exception as e:
-                logger.error(f"Error processing websocket message: {e}")
+            if message["type"] == "progress":
+                await self.on_progress(data)
+
+            if message["type"] in ("execution_error", "execution_interrupted"):
+                await self.on_execution_failed(message["type"], data)
+        except Exception as e:
+            logger.error(f"Error processing websocket message: {e}")
 
     async def on_execution_start(self, data):
         """Handle execution start message"""
@@ -145,19 +214,24 @@ class ComfyJob(BaseJob):
             return
         logger.info(f"Execution started for prompt {self.prompt_id}")
         self.state = Status.RUNNING
+        self.started.set()
+
+    async def on_execution_failed(self, message_type, data):
+        """Handle execution error or interruption messages"""
+        if data["prompt_id"] != self.prompt_id:
+            return
+        reason = data.get("exception_message") or message_type.replace("_", " ")
+        logger.error(f"Execution failed for prompt {self.prompt_id}: {reason}")
+        self.error = JobExecutionError(reason)
+        self.started.set()
+        self.finished.set()
 
     async def on_progress(self, data):
         """Handle progress updates"""
         if self.state != Status.RUNNING:
             return
 
-        # Rate limiting - only update every 0.5 seconds to prevent spam while staying responsive
-        current_time = time.time()
-        if current_time - self.last_update < 0.5:
-            return
-
-        self.last_update = current_time
-
+        # Pacing is left to the progress callback, which coalesces updates.
         # Only call progress callback if it exists
         if self.progress_callback:
             await self.progress_callback(data["value"] / data["max"], self.progress_image)
@@ -172,27 +246,50 @@ class ComfyJob(BaseJob):
             if self.progress_callback:
                 await self.progress_callback(1, self.progress_image)
             self.state = Status.IMAGE_READY
+            self.started.set()
+            self.finished.set()
 
     async def get_images(self):
-        """Retrieve generated images from ComfyUI"""
+        """Retrieve generated images from ComfyUI.
+
+        Outputs are downloaded concurrently into file objects. The caller owns
+        the returned files and must close any it does not hand to Discord.
+        """
         try:
             logger.info(f"Retrieving images for prompt {self.prompt_id}")
-            output_images = {}
-            history = await get_history(self.prompt_id)
+            history = await self.backend.client.get_history(self.prompt_id)
             history_data = history[self.prompt_id]
-            
+
+            semaphore = asyncio.Semaphore(comfy_download_concurrency)
+
+            async def download(image):
+                async with semaphore:
+                    logger.debug(f"Getting image: {image}")
+                    return await self.backend.client.get_image_file(
+                        image["filename"], image["subfolder"], image["type"]
+                    )
+
+            image_nodes = []
+            downloads = []
             for node_id in history_data["outputs"]:
                 node_output = history_data["outputs"][node_id]
                 if "images" in node_output:
-                    images_output = []
                     for image in node_output["images"]:
-                        logger.debug(f"Getting image: {image}")
-                        image_data = await get_image(
-                            image["filename"], image["subfolder"], image["type"]
-                        )
-                        images_output.append(image_data)
-                    output_images[node_id] = images_output
-            
+                        image_nodes.append(node_id)
+                        downloads.append(download(image))
+
+            results = await asyncio.gather(*downloads, return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                for result in results:
+                    if not isinstance(result, BaseException):
+                        result.close()
+                raise errors[0]
+
+            output_images = {}
+            for node_id, image_file in zip(image_nodes, results):
+                output_images.setdefault(node_id, []).append(image_file)
+
             logger.info(f"Retrieved {len(output_images)} output nodes with images")
             return output_images
         except Exception as e:
@@ -200,6 +297,21 @@ class ComfyJob(BaseJob):
             raise
 
 
+def first_image(images):
+    """Return the first image file from a get_images result and close the rest"""
+    image = next((image for node_images in images.values() for image in node_images), None)
+    close_images(images, keep=image)
+    return image
+
+
+def close_images(images, keep=None):
+    """Close every image file in a get_images result except keep"""
+    for node_images in images.values():
+        for image in node_images:
+            if image is not keep:
+                image.close()
+
+
 class ReplicateJob(BaseJob):
     """Job class for Replicate-based tasks (Flux, Video, etc.)"""
 
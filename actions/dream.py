@@ -1,11 +1,13 @@
 from collections.abc import Coroutine
-from settings import templateEnv, sd_loras, sdxl_loras, sd_template, sdxl_template
+from settings import sd_template, sdxl_template
 import io
-import json
 import logging
 from models.sd_options import SDOptions, SDType
-import re
+from models.lora_catalog import lora_catalog
 from actions.base_job import ComfyJob, Status
+from actions.job_results import job_results
+from actions.workflow import build_workflow
+from api.job_scheduler import Priority
 from utils.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -13,9 +15,12 @@ logger = get_logger(__name__)
 
 async def dream(
     sd_options: SDOptions,
-    progress_callback: Coroutine[float, io.BytesIO, None]
+    progress_callback: Coroutine[float, io.BytesIO, None],
+    user_id=None,
+    guild_id=None,
+    priority: Priority = Priority.INTERACTIVE,
 ):
-    prompt, loras = extract_loras(sd_options.prompt)
+    prompt, loras = extract_loras(sd_options.prompt, sd_options.sd_type)
     template = sd_template if sd_options.sd_type == SDType.SD else sdxl_template
 
     options = {
@@ -40,52 +45,22 @@ async def dream(
         options["width"] = round_to_multiple(options["width"] / 2, 4)
         options["height"] = round_to_multiple(options["height"] / 2, 4)
 
-    rendered_template = templateEnv.get_template(template).render(**options)
-    logger.debug(f"Rendered template: {rendered_template[:200]}...")  # Log first 200 chars
-    promptJson = json.loads(rendered_template)
-    job = DrawJob(promptJson, progress_callback)
-
-    images = await job.run()
-
-    for node_id in images:
-        for image_data in images[node_id]:
-            return io.BytesIO(image_data)
+    promptJson = build_workflow(template, **options)
+    job = DrawJob(promptJson, progress_callback, user_id, guild_id, priority)
+    return await job_results.run(job)
 
 
 def round_to_multiple(number, multiple):
     return multiple * round(number / multiple)
 
 
-def extract_loras(prompt):
-    clean_prompt = prompt
-    lora_regex = "(lora:\S+:\d+\.?\d*)"
-    matches = re.findall(lora_regex, prompt)
-
-    prompt_loras = []
-    for lora in matches:
-        clean_prompt = clean_prompt.replace(lora, "")
-        lora_segs = lora.split(":")
-        prompt_loras.append({
-            "name": lora_segs[1], "strength": lora_segs[2]
-        })
-
-    # clean up lora list.
-    loras = []
-    for lora in prompt_loras:
-        for known_lora in [*sd_loras, *sdxl_loras]:
-            if lora["name"] == known_lora.name or lora["name"] == known_lora.value:
-                loras.append({
-                    "name": known_lora.value,
-                    "strength": lora["strength"]
-                })
-                break
-
-    clean_prompt = clean_prompt.strip()
-    return clean_prompt, loras
+def extract_loras(prompt, sd_type: SDType = None):
+    """Split LoRA tags out of a prompt, rejecting ones for a different SDType"""
+    return lora_catalog.parse_prompt(prompt, sd_type.value if sd_type else None)
 
 
 class DrawJob(ComfyJob):
     """Job class for dream/drawing operations"""
     
-    def __init__(self, prompt, progress_callback):
-        super().__init__(prompt, progress_callback)
+    def __init__(self, prompt, progress_callback, user_id=None, guild_id=None, priority=Priority.INTERACTIVE):
+        super().__init__(prompt, progress_callback, user_id, guild_id, priority)
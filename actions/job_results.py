@@ -0,0 +1,104 @@
+import asyncio
+import io
+from collections import OrderedDict
+from actions.base_job import first_image
+from actions.workflow import workflow_hash
+from api.artifact_store import artifact_store
+from settings import job_result_cache_size
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class JobResults:
+    """Shares the results of identical ComfyUI jobs.
+
+    Jobs are keyed by a hash of their workflow, which includes the seed, so
+    equal keys produce the same image. A job submitted while an identical one
+    is running waits for that one instead of being queued. Finished results
+    are remembered by their artifact store hash, so a repeat is served from
+    disk until the file or the entry is evicted.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.results = OrderedDict()  # workflow hash -> artifact hash, least recently used first
+        self.in_flight = {}  # workflow hash -> task storing the result
+
+    async def run(self, job, cleanup=None):
+        """First image of a job as a new file object, or None if it made none.
+
+        cleanup is called once the job's own inputs are no longer needed,
+        whether or not the job ran.
+        """
+        key = workflow_hash(job.prompt)
+        try:
+            digest = self.results.get(key)
+            if digest is not None:
+                image = await self._open(digest)
+                if image is not None:
+                    self.results.move_to_end(key)
+                    logger.info(f"Reusing result of workflow {key[:12]}")
+                    return image
+                self.results.pop(key, None)
+
+            task = self.in_flight.get(key)
+            if task is None:
+                task = self.in_flight[key] = asyncio.create_task(self._run_job(job, key, cleanup))
+                task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+                cleanup = None
+            else:
+                logger.info(f"Waiting on identical running workflow {key[:12]}")
+
+            # Shielded so one caller giving up does not cancel the job for the others.
+            digest, data = await asyncio.shield(task)
+        finally:
+            if cleanup is not None:
+                cleanup()
+
+        if data is not None:
+            return io.BytesIO(data)
+        if digest is None:
+            return None
+        image = await self._open(digest)
+        if image is None:
+            raise FileNotFoundError(f"Result of workflow {key[:12]} was evicted before it could be sent")
+        return image
+
+    async def _run_job(self, job, key, cleanup):
+        """Run a job and store its image.
+
+        Returns the artifact hash, or the image bytes if it could not be
+        stored. Both are None if the job made no image.
+        """
+        try:
+            image = first_image(await job.run())
+        finally:
+            if cleanup is not None:
+                cleanup()
+        if image is None:
+            return None, None
+
+        try:
+            digest = await artifact_store.add_file(image)
+            if digest is None:
+                image.seek(0)
+                return None, await asyncio.to_thread(image.read)
+        finally:
+            image.close()
+
+        self.results[key] = digest
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+        return digest, None
+
+    async def _open(self, digest):
+        try:
+            return await asyncio.to_thread(open, artifact_store.path_for(digest), "rb")
+        except FileNotFoundError:
+            return None
+
+
+# Global instance
+job_results = JobResults(job_result_cache_size)
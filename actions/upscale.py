@@ -1,34 +1,84 @@
 from collections.abc import Coroutine
-from settings import templateEnv
+import asyncio
+import hashlib
+import os
+import aiohttp
 import discord
 import io
-import json
-import base64
 from actions.base_job import ComfyJob
+from actions.job_results import job_results
+from actions.workflow import build_workflow
+from api.comfy_api import spool_response
+from api.job_scheduler import Priority
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
 
 async def upscale(
     image: discord.Attachment,
-    progress_callback: Coroutine[float, io.BytesIO, None]
+    progress_callback: Coroutine[float, io.BytesIO, None],
+    user_id=None,
+    guild_id=None,
+    priority: Priority = Priority.INTERACTIVE,
 ):
-    imageBytes = await image.read()
+    image_file, digest = await spool_attachment(image)
+    try:
+        extension = os.path.splitext(image.filename or "")[1].lower() or ".png"
+        job = UpscaleJob(image_file, f"{digest}{extension}", digest, progress_callback, user_id, guild_id, priority)
+    except BaseException:
+        image_file.close()
+        raise
+    return await job_results.run(job, cleanup=image_file.close)
 
-    options = {
-        "image": base64.b64encode(imageBytes).decode(),
-    }
 
-    rendered_template = templateEnv.get_template("upscale.j2").render(**options)
-    promptJson = json.loads(rendered_template)
-    job = UpscaleJob(promptJson, progress_callback)
+async def spool_attachment(image):
+    """Copy an attachment into a file object, returning it with its SHA-256.
 
-    images = await job.run()
+    Attachments from the artifact store are opened in place, as they are
+    already named by their hash. Others are streamed from Discord.
+    """
+    path = getattr(image, "path", None)
+    if path is not None:
+        try:
+            return await asyncio.to_thread(open, path, "rb"), os.path.basename(path)
+        except FileNotFoundError:
+            image = image.attachment
 
-    for node_id in images:
-        for image_data in images[node_id]:
-            return io.BytesIO(image_data)
+    sha = hashlib.sha256()
+    async with aiohttp.ClientSession(raise_for_status=True) as session:
+        async with session.get(image.url) as response:
+            image_file = await spool_response(response, digest=sha)
+    return image_file, sha.hexdigest()
 
 
 class UpscaleJob(ComfyJob):
-    """Job class for upscaling operations"""
-    
-    def __init__(self, prompt, progress_callback):
-        super().__init__(prompt, progress_callback)
+    """Job class for upscaling operations.
+
+    The input image is uploaded to the chosen backend with a multipart
+    request and referenced by name from a LoadImage node.
+    """
+
+    def __init__(self, image_file, filename, digest, progress_callback, user_id=None, guild_id=None, priority=Priority.INTERACTIVE):
+        super().__init__(build_workflow("upscale.j2", image=filename), progress_callback, user_id, guild_id, priority)
+        self.image_file = image_file
+        self.filename = filename
+        self.digest = digest
+
+    async def prepare(self):
+        self.image_file.seek(0)
+        image_name = await self.backend.upload_image(self.image_file, self.digest, self.filename)
+        self.prompt = build_workflow("upscale.j2", image=image_name)
+
+    async def send_prompt(self):
+        try:
+            await super().send_prompt()
+        except aiohttp.ClientResponseError as e:
+            if e.status != 400:
+                raise
+            # The backend rejected the prompt, most likely because the
+            # uploaded input is gone. Upload it again and retry once.
+            logger.warning(f"Prompt rejected by {self.backend.address}, uploading {self.filename} again")
+            self.backend.forget_upload(self.digest)
+            await self.prepare()
+            await super().send_prompt()
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import math
+import re
+from settings import templateEnv
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Placeholders rendered into a template to find where each option lands.
+# {{ x }} prints str(x), giving the RAW form; tojson prints the string value,
+# giving the JSON form.
+_SLOT_PATTERN = re.compile(r'("?)__(RAW|JSON)_(\w+?)__("?)')
+_SLOT_VALUE = re.compile(r"__SLOT_(STR|RAW|JSON)_(\w+?)__")
+
+
+class _Sentinel(str):
+    def __new__(cls, name):
+        sentinel = super().__new__(cls, f"__JSON_{name}__")
+        sentinel.raw = f"__RAW_{name}__"
+        return sentinel
+
+    def __str__(self):
+        return self.raw
+
+
+def _structure_key(options):
+    """Options that change the shape of a rendered workflow.
+
+    None values and list lengths can switch template branches and loops;
+    everything else only fills in values.
+    """
+    return tuple(
+        (name, len(value) if isinstance(value, list) else value is None)
+        for name, value in sorted(options.items())
+    )
+
+
+def _sentinel_options(options):
+    sentinels = {}
+    for name, value in options.items():
+        if value is None:
+            sentinels[name] = None
+        elif isinstance(value, list):
+            sentinels[name] = [
+                {field: _Sentinel(f"{name}_{index}_{field}") for field in item}
+                for index, item in enumerate(value)
+            ]
+        else:
+            sentinels[name] = _Sentinel(name)
+    return sentinels
+
+
+def _flatten_options(options):
+    values = {}
+    for name, value in options.items():
+        if isinstance(value, list):
+            for index, item in enumerate(value):
+                for field, field_value in item.items():
+                    values[f"{name}_{index}_{field}"] = field_value
+        elif value is not None:
+            values[name] = value
+    return values
+
+
+def _copy_graph(value):
+    if type(value) is dict:
+        return {key: _copy_graph(item) for key, item in value.items()}
+    if type(value) is list:
+        return [_copy_graph(item) for item in value]
+    return value
+
+
+def _slot_value(mode, value):
+    """Convert an option the same way rendering and json.loads would"""
+    if mode == "JSON":
+        return value
+    if mode == "STR":
+        return str(value)
+    if type(value) is int or (type(value) is float and math.isfinite(value)):
+        return value
+    return json.loads(str(value))
+
+
+class WorkflowTemplate:
+    """A template rendered once into a graph with known value slots.
+
+    build() copies the graph and writes each option into its slots, giving
+    the same result as rendering the template and parsing the JSON.
+    """
+
+    def __init__(self, template_name, options):
+        sentinels = _sentinel_options(options)
+        rendered = templateEnv.get_template(template_name).render(**sentinels)
+        rendered = _SLOT_PATTERN.sub(self._normalize_slot, rendered)
+        self.template_name = template_name
+        self.graph = json.loads(rendered)
+        self.slots = []  # (node_id, input_name, mode, option name)
+        for node_id, node in self.graph.items():
+            for input_name, value in node.get("inputs", {}).items():
+                if not isinstance(value, str) or "__SLOT_" not in value:
+                    continue
+                match = _SLOT_VALUE.fullmatch(value)
+                if match is None:
+                    raise ValueError(
+                        f"{template_name}: option used inside a larger value at {node_id}.{input_name}"
+                    )
+                self.slots.append((node_id, input_name, match.group(1), match.group(2)))
+        if len(self.slots) != rendered.count("__SLOT_"):
+            raise ValueError(f"{template_name}: options are only supported as node input values")
+
+        # Plain nodes are copied with dict.copy() and their links re-sliced,
+        # which is much faster than a recursive copy.
+        self.nodes = []  # (node_id, node, link input names or None for a full copy)
+        for node_id, node in self.graph.items():
+            inputs = node.get("inputs")
+            if tuple(node) != ("inputs", "class_type") or type(inputs) is not dict:
+                self.nodes.append((node_id, node, None))
+                continue
+            links = [name for name, value in inputs.items() if type(value) is list]
+            if any(type(item) not in (str, int) for name in links for item in inputs[name]):
+                self.nodes.append((node_id, node, None))
+            elif any(type(value) is dict for value in inputs.values()):
+                self.nodes.append((node_id, node, None))
+            else:
+                self.nodes.append((node_id, node, links))
+
+    @staticmethod
+    def _normalize_slot(match):
+        open_quote, form, name, close_quote = match.groups()
+        if form == "JSON":
+            mode = "JSON"
+        elif open_quote and close_quote:
+            mode = "STR"
+        else:
+            mode = "RAW"
+        return f'"__SLOT_{mode}_{name}__"'
+
+    def build(self, options):
+        values = _flatten_options(options)
+        graph = {}
+        for node_id, node, links in self.nodes:
+            if links is None:
+                graph[node_id] = _copy_graph(node)
+                continue
+            inputs = node["inputs"].copy()
+            for name in links:
+                inputs[name] = inputs[name][:]
+            graph[node_id] = {"inputs": inputs, "class_type": node["class_type"]}
+        for node_id, input_name, mode, name in self.slots:
+            graph[node_id]["inputs"][input_name] = _slot_value(mode, values[name])
+        return graph
+
+
+_workflow_templates = {}  # (template name, structure key) -> WorkflowTemplate
+
+
+def build_workflow(template_name, **options):
+    """ComfyUI prompt graph for a template filled in with options"""
+    key = (template_name, _structure_key(options))
+    workflow_template = _workflow_templates.get(key)
+    if workflow_template is None:
+        workflow_template = _workflow_templates[key] = WorkflowTemplate(template_name, options)
+        logger.debug(f"Compiled {template_name} with {len(workflow_template.slots)} slots")
+    return workflow_template.build(options)
+
+
+def workflow_hash(prompt):
+    """SHA-256 of a prompt graph, independent of key order and formatting"""
+    canonical = json.dumps(prompt, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
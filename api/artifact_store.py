@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from api.sqlite_manager import SQLiteManager
+from settings import artifact_store_path, artifact_store_max_bytes
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DATABASE_PATH = "artifacts.db"
+CHUNK_SIZE = 64 * 1024
+
+
+class StoredAttachment:
+    """A message attachment served from the local store.
+
+    Has the parts of discord.Attachment the follow-up actions use, and falls
+    back to the original attachment if the file has been evicted.
+    """
+
+    def __init__(self, path, filename, attachment=None):
+        self.path = path
+        self.filename = filename
+        self.attachment = attachment
+
+    @property
+    def url(self):
+        return self.attachment.url if self.attachment else None
+
+    async def read(self):
+        try:
+            return await asyncio.to_thread(self._read)
+        except FileNotFoundError:
+            if self.attachment is None:
+                raise
+            return await self.attachment.read()
+
+    def _read(self):
+        with open(self.path, "rb") as file:
+            return file.read()
+
+
+class ArtifactStore:
+    """Content-addressed store for generated outputs on local disk.
+
+    Files are named by their SHA-256 and indexed by the Discord message they
+    were sent in; job_db links that message to its job. The least recently
+    used files are evicted once the store grows past max_bytes.
+    """
+
+    def __init__(self, root, max_bytes, db_path=DATABASE_PATH):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.db = SQLiteManager(db_path)
+        self.sizes = OrderedDict()  # hash -> size, least recently used first
+        self.total_bytes = 0
+        self.loaded = False
+
+    async def init(self):
+        os.makedirs(self.root, exist_ok=True)
+        async with self.db.transaction() as db:
+            await db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """
+            )
+            await db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS message_artifacts (
+                    message_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    hash TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    PRIMARY KEY (message_id, position)
+                )
+            """
+            )
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_message_artifacts_hash ON message_artifacts (hash)"
+            )
+
+        rows = await self.db.fetchall("SELECT hash, size FROM artifacts ORDER BY last_used")
+        self.sizes = OrderedDict((row[0], row[1]) for row in rows)
+        self.total_bytes = sum(self.sizes.values())
+        self.loaded = True
+        logger.info(f"Artifact store has {len(self.sizes)} files, {self.total_bytes} bytes")
+
+    async def close(self):
+        await self.db.close()
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    async def add_file(self, file):
+        """Copy a file object into the store and return its hash.
+
+        The file is rewound afterwards so it can still be uploaded. Returns
+        None if the store is not ready or the file could not be written.
+        Files opened from the store itself are only marked as used.
+        """
+        digest = self._stored_digest(file)
+        if digest is None:
+            return await self._add(self._write_file, file)
+        try:
+            await self._record(digest, self.sizes[digest])
+        except Exception as e:
+            logger.warning(f"Unable to store artifact: {e}")
+            return None
+        return digest
+
+    def _stored_digest(self, file):
+        """Hash of a file opened from the store itself, or None"""
+        path = getattr(file, "name", None)
+        if not isinstance(path, str):
+            return None
+        digest = os.path.basename(path)
+        if digest in self.sizes and os.path.abspath(path) == os.path.abspath(self.path_for(digest)):
+            return digest
+        return None
+
+    async def add_bytes(self, data: bytes):
+        """Store bytes and return their hash, or None on failure"""
+        return await self._add(self._write_bytes, data)
+
+    async def _add(self, write, source):
+        if not self.loaded:
+            return None
+        try:
+            digest, size = await asyncio.to_thread(write, source)
+            await self._record(digest, size)
+        except Exception as e:
+            logger.warning(f"Unable to store artifact: {e}")
+            return None
+        return digest
+
+    async def link_message(self, message_id, artifacts):
+        """Index stored artifacts as the attachments of a message.
+
+        artifacts is a list of (hash, filename) in attachment order. Nothing
+        is indexed if any of them failed to store.
+        """
+        if not artifacts or any(digest is None for digest, _ in artifacts):
+            return
+        async with self.db.transaction() as db:
+            await db.executemany(
+                "INSERT OR REPLACE INTO message_artifacts (message_id, position, hash, filename) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (message_id, position, digest, filename)
+                    for position, (digest, filename) in enumerate(artifacts)
+                ],
+            )
+
+    async def get_attachments(self, message):
+        """Attachments of a message, read from the store where possible.
+
+        Returns the message's own attachments if any of them are not stored.
+        """
+        if not self.loaded or not message.attachments:
+            return list(message.attachments)
+
+        rows = await self.db.fetchall(
+            "SELECT hash, filename FROM message_artifacts WHERE message_id = ? ORDER BY position",
+            (message.id,),
+        )
+        if len(rows) != len(message.attachments) or any(row[0] not in self.sizes for row in rows):
+            return list(message.attachments)
+
+        for digest, _ in rows:
+            self.sizes.move_to_end(digest)
+        await self.db.execute(
+            f"UPDATE artifacts SET last_used = ? WHERE hash IN ({', '.join('?' for _ in rows)})",
+            (time.time(), *[row[0] for row in rows]),
+        )
+        return [
+            StoredAttachment(self.path_for(digest), filename, attachment)
+            for (digest, filename), attachment in zip(rows, message.attachments)
+        ]
+
+    async def _record(self, digest, size):
+        if digest in self.sizes:
+            self.sizes.move_to_end(digest)
+        else:
+            self.sizes[digest] = size
+            self.total_bytes += size
+        await self.db.execute(
+            "INSERT INTO artifacts (hash, size, last_used) VALUES (?, ?, ?) "
+            "ON CONFLICT(hash) DO UPDATE SET last_used = excluded.last_used",
+            (digest, size, time.time()),
+        )
+        await self._evict()
+
+    async def _evict(self):
+        evicted = []
+        # Never evict the file that was just added.
+        while self.total_bytes > self.max_bytes and len(self.sizes) > 1:
+            digest, size = self.sizes.popitem(last=False)
+            self.total_bytes -= size
+            evicted.append(digest)
+        if not evicted:
+            return
+
+        await asyncio.to_thread(self._remove_files, evicted)
+        placeholders = ", ".join("?" for _ in evicted)
+        async with self.db.transaction() as db:
+            await db.execute(f"DELETE FROM artifacts WHERE hash IN ({placeholders})", evicted)
+            await db.execute(f"DELETE FROM message_artifacts WHERE hash IN ({placeholders})", evicted)
+        logger.debug(f"Evicted {len(evicted)} artifacts")
+
+    def _remove_files(self, digests):
+        for digest in digests:
+            try:
+                os.remove(self.path_for(digest))
+            except FileNotFoundError:
+                pass
+
+    def _store_temp(self, temp_path, digest):
+        path = self.path_for(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def _write_file(self, file):
+        file.seek(0)
+        sha = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                while chunk := file.read(CHUNK_SIZE):
+                    sha.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+            digest = sha.hexdigest()
+            self._store_temp(temp_path, digest)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        finally:
+            file.seek(0)
+        return digest, size
+
+    def _write_bytes(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self.path_for(digest)):
+            fd, temp_path = tempfile.mkstemp(dir=self.root)
+            try:
+                with os.fdopen(fd, "wb") as temp:
+                    temp.write(data)
+                self._store_temp(temp_path, digest)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        return digest, len(data)
+
+
+# Global instance
+artifact_store = ArtifactStore(artifact_store_path, artifact_store_max_bytes)
+
+
+async def init_artifact_store():
+    await artifact_store.init()
+
+
+async def close_artifact_store():
+    await artifact_store.close()
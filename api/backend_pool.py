@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List
+from api.comfy_api import ComfyClient
+from api.websocket_subsystem import WebSocketSubsystem
+from settings import server_ips, comfy_health_interval, comfy_unhealthy_threshold
+
+logger = logging.getLogger(__name__)
+
+# Input image hashes remembered per backend.
+MAX_TRACKED_UPLOADS = 1024
+
+
+class NoBackendAvailableError(RuntimeError):
+    """Raised when no healthy ComfyUI backend can take a job"""
+
+
+class ComfyBackend:
+    """A single ComfyUI server with its own HTTP client, websocket and health state"""
+
+    def __init__(self, address):
+        self.address = address
+        self.client = ComfyClient(address)
+        self.websocket = WebSocketSubsystem(address)
+        self.healthy = False
+        self.failures = 0
+        self.queue_depth = 0
+        self.running_jobs = 0
+        self.uploads = OrderedDict()  # content hash -> task resolving to the stored image name
+
+    @property
+    def available(self):
+        return self.healthy and self.websocket.connected
+
+    @property
+    def load(self):
+        # The websocket status and /queue poll can lag behind jobs we just
+        # submitted, so never report less than what this bot has in flight.
+        queue_depth = max(self.queue_depth, self.websocket.queue_remaining)
+        return max(queue_depth, self.running_jobs)
+
+    async def upload_image(self, file, digest, filename):
+        """Upload an input image once, returning the name LoadImage should use.
+
+        Uploads are keyed by content hash, so the same bytes are only sent to
+        this backend once even if several jobs ask for them at the same time.
+        """
+        upload = self.uploads.get(digest)
+        if upload is None:
+            upload = self.uploads[digest] = asyncio.ensure_future(self._upload_image(file, filename))
+            if len(self.uploads) > MAX_TRACKED_UPLOADS:
+                self.uploads.popitem(last=False)
+        else:
+            self.uploads.move_to_end(digest)
+
+        try:
+            return await asyncio.shield(upload)
+        except Exception:
+            if self.uploads.get(digest) is upload:
+                del self.uploads[digest]
+            raise
+
+    def forget_upload(self, digest):
+        """Upload an image again the next time it is needed"""
+        self.uploads.pop(digest, None)
+
+    async def _upload_image(self, file, filename):
+        result = await self.client.upload_image(file, filename)
+        logger.info(f"Uploaded {filename} to {self.address}")
+        if result.get("subfolder"):
+            return f"{result['subfolder']}/{result['name']}"
+        return result["name"]
+
+    async def check_health(self):
+        """Poll /queue and update the health state"""
+        try:
+            queue = await self.client.get_queue()
+            self.queue_depth = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+            self.failures = 0
+            if not self.healthy:
+                logger.info(f"ComfyUI backend {self.address} is healthy")
+                # It may have restarted or lost its input folder while drained.
+                self.uploads.clear()
+            self.healthy = True
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Health check failed for ComfyUI backend {self.address}: {e}")
+            if self.healthy and self.failures >= comfy_unhealthy_threshold:
+                logger.error(f"Draining unhealthy ComfyUI backend {self.address}")
+                self.healthy = False
+
+
+class BackendPool:
+    """Pool of ComfyUI backends with queue-depth-aware load balancing"""
+
+    def __init__(self, addresses: List[str], health_interval=None):
+        self.backends = [ComfyBackend(address) for address in addresses]
+        self.health_interval = health_interval or comfy_health_interval
+        self.health_task = None
+        self.running = False
+
+    async def start(self):
+        """Open every backend and start websockets and health checks"""
+        if self.running:
+            return
+
+        self.running = True
+        loop = asyncio.get_running_loop()
+        for backend in self.backends:
+            await backend.client.start()
+            await backend.websocket.start(loop)
+        await self.check_health()
+        self.health_task = loop.create_task(self._health_loop())
+        logger.info(f"Backend pool started with {len(self.backends)} backends")
+
+    async def stop(self):
+        """Stop health checks and close every backend"""
+        if not self.running:
+            return
+
+        self.running = False
+        if self.health_task:
+            self.health_task.cancel()
+        for backend in self.backends:
+            backend.websocket.stop()
+            await backend.client.close()
+        logger.info("Backend pool stopped")
+
+    async def restart_websockets(self):
+        """Reconnect the websocket of every backend"""
+        loop = asyncio.get_running_loop()
+        for backend in self.backends:
+            backend.websocket.stop()
+            await backend.websocket.start(loop)
+
+    async def check_health(self):
+        await asyncio.gather(*(backend.check_health() for backend in self.backends))
+
+    async def _health_loop(self):
+        while self.running:
+            try:
+                await asyncio.sleep(self.health_interval)
+                await self.check_health()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Backend health loop error: {e}")
+
+    def is_available(self):
+        return any(backend.available for backend in self.backends)
+
+    def select(self) -> ComfyBackend:
+        """Pick the least loaded healthy backend"""
+        available = [backend for backend in self.backends if backend.available]
+        if not available:
+            raise NoBackendAvailableError("No healthy ComfyUI backend available")
+        return min(available, key=lambda backend: (backend.load, backend.running_jobs))
+
+    async def get_system_info(self):
+        """Fetch /object_info from the first backend that answers"""
+        errors = []
+        for backend in self.backends:
+            try:
+                return await backend.client.get_system_info()
+            except Exception as e:
+                errors.append(e)
+                logger.warning(f"Failed to get system info from {backend.address}: {e}")
+        raise errors[0] if errors else NoBackendAvailableError("No ComfyUI backends configured")
+
+
+# Global instance
+backend_pool = BackendPool(server_ips)
@@ -1,19 +1,31 @@
-import aiosqlite
+from api.sqlite_manager import SQLiteManager
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Bumped on every prompt update so callers can tell when a cached copy of a
+# server or user prompt is stale.
+_server_prompt_versions = {}  # server_id -> version
+_user_prompt_versions = {}  # user_id -> version
 
 DATABASE_PATH = "chat_history.db"
 
+_db = SQLiteManager(DATABASE_PATH)
+
+
+# Bumped whenever the schema changes; stored in PRAGMA user_version.
+SCHEMA_VERSION = 2
+
 
 async def init_chat_db():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS chat_history (
-                server_id TEXT,
-                message TEXT,
-                role TEXT
-            )
-        """
-        )
+    async with _db.transaction() as db:
+        async with db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        if version < 1:
+            await _migrate_chat_history(db)
+        if version < 2:
+            # Token counts for older rows are filled in on the next truncation.
+            await db.execute("ALTER TABLE chat_history ADD COLUMN token_count INTEGER")
         await db.execute(
             """
             CREATE TABLE IF NOT EXISTS system_prompts (
@@ -30,87 +42,165 @@ async def init_chat_db():
             )
         """
         )
-        await db.commit()
+        await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+async def _create_chat_history(db):
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server_id TEXT NOT NULL,
+            message TEXT,
+            role TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_server_id ON chat_history (server_id, id)"
+    )
+
+
+async def _migrate_chat_history(db):
+    """Rewrite the original unkeyed chat_history table into the indexed schema"""
+    async with db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_history'"
+    ) as cursor:
+        has_old_table = await cursor.fetchone() is not None
+
+    if not has_old_table:
+        await _create_chat_history(db)
+        return
+
+    await db.execute("ALTER TABLE chat_history RENAME TO chat_history_old")
+    await _create_chat_history(db)
+    # The old table's implicit rowid preserves insertion order.
+    await db.execute(
+        """
+        INSERT INTO chat_history (server_id, message, role)
+        SELECT server_id, message, role FROM chat_history_old
+        WHERE server_id IS NOT NULL
+        ORDER BY rowid
+    """
+    )
+    await db.execute("DROP TABLE chat_history_old")
+    logger.info("Migrated chat_history to schema version 1")
+
+
+async def close_chat_db():
+    await _db.close()
 
 
 async def get_server_prompt(server_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT additional_prompt FROM system_prompts WHERE server_id = ?",
-            (server_id,),
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return row[0]
-            return ""
+    row = await _db.fetchone(
+        "SELECT additional_prompt FROM system_prompts WHERE server_id = ?",
+        (server_id,),
+    )
+    if row:
+        return row[0]
+    return ""
 
 
 async def get_user_prompt(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT additional_prompt FROM user_prompts WHERE user_id = ?", (user_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return row[0]
-            return ""
+    row = await _db.fetchone(
+        "SELECT additional_prompt FROM user_prompts WHERE user_id = ?", (user_id,)
+    )
+    if row:
+        return row[0]
+    return ""
+
+
+def get_prompt_versions(server_id, user_id):
+    """Current (server prompt, user prompt) versions"""
+    return _server_prompt_versions.get(server_id, 0), _user_prompt_versions.get(user_id, 0)
 
 
 async def get_chat_history(server_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT message, role FROM chat_history WHERE server_id = ?", (server_id,)
-        ) as cursor:
-            return await cursor.fetchall()
+    """(id, message, role) rows for a server, oldest first"""
+    return await _db.fetchall(
+        "SELECT id, message, role FROM chat_history WHERE server_id = ? ORDER BY id",
+        (server_id,),
+    )
 
 
-async def insert_chat_history(server_id, message, role):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            "INSERT INTO chat_history (server_id, message, role) VALUES (?, ?, ?)",
-            (server_id, message, role),
+async def get_uncounted_chats(server_id):
+    """(id, message) rows for a server that have no stored token count"""
+    return await _db.fetchall(
+        "SELECT id, message FROM chat_history WHERE server_id = ? AND token_count IS NULL ORDER BY id",
+        (server_id,),
+    )
+
+
+async def get_truncation_point(server_id, max_tokens):
+    """Newest chat id that must be deleted for a server's history to fit max_tokens.
+
+    Returns None if the history already fits.
+    """
+    row = await _db.fetchone(
+        """
+        SELECT id FROM (
+            SELECT id, SUM(token_count) OVER (ORDER BY id DESC) AS tokens_from_here
+            FROM chat_history WHERE server_id = ?
         )
-        await db.commit()
+        WHERE tokens_from_here > ? ORDER BY id DESC LIMIT 1
+        """,
+        (server_id, max_tokens),
+    )
+    return row[0] if row else None
 
 
-async def clear_chat_history(server_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("DELETE FROM chat_history WHERE server_id = ?", (server_id,))
-        await db.commit()
+async def insert_chat_history(server_id, message, role, token_count=None):
+    async with _db.transaction() as db:
+        cursor = await db.execute(
+            "INSERT INTO chat_history (server_id, message, role, token_count) VALUES (?, ?, ?, ?)",
+            (server_id, message, role, token_count),
+        )
+        return cursor.lastrowid
 
 
-async def delete_single_chat(server_id, message, role):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            "DELETE FROM chat_history WHERE server_id = ? AND message = ? AND role = ?",
-            (server_id, message, role),
+async def update_token_counts(token_counts):
+    """Store token counts given as (chat_id, token_count) pairs"""
+    async with _db.transaction() as db:
+        await db.executemany(
+            "UPDATE chat_history SET token_count = ? WHERE id = ?",
+            [(token_count, chat_id) for chat_id, token_count in token_counts],
         )
-        await db.commit()
+
+
+async def clear_chat_history(server_id):
+    await _db.execute("DELETE FROM chat_history WHERE server_id = ?", (server_id,))
+
+
+async def delete_chats_through(server_id, chat_id):
+    """Delete a server's history up to and including chat_id"""
+    await _db.execute(
+        "DELETE FROM chat_history WHERE server_id = ? AND id <= ?",
+        (server_id, chat_id),
+    )
 
 
 async def update_server_prompt(server_id, prompt):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO system_prompts (server_id, additional_prompt)
-            VALUES (?, ?)
-            ON CONFLICT(server_id) DO UPDATE SET
-            additional_prompt=excluded.additional_prompt;
-        """,
-            (server_id, prompt),
-        )
-        await db.commit()
+    await _db.execute(
+        """
+        INSERT INTO system_prompts (server_id, additional_prompt)
+        VALUES (?, ?)
+        ON CONFLICT(server_id) DO UPDATE SET
+        additional_prompt=excluded.additional_prompt;
+    """,
+        (server_id, prompt),
+    )
+    _server_prompt_versions[server_id] = _server_prompt_versions.get(server_id, 0) + 1
 
 
 async def update_user_prompt(user_id, prompt):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO user_prompts (user_id, additional_prompt)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-            additional_prompt=excluded.additional_prompt;
-        """,
-            (user_id, prompt),
-        )
-        await db.commit()
+    await _db.execute(
+        """
+        INSERT INTO user_prompts (user_id, additional_prompt)
+        VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+        additional_prompt=excluded.additional_prompt;
+    """,
+        (user_id, prompt),
+    )
+    _user_prompt_versions[user_id] = _user_prompt_versions.get(user_id, 0) + 1
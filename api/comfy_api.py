@@ -1,42 +1,195 @@
+import io
 import json
 import aiohttp
+import asyncio
+import logging
+import tempfile
 import urllib.parse
-from settings import server_ip, client_id
+from settings import (
+    client_id,
+    comfy_http_connection_limit,
+    comfy_http_keepalive,
+    comfy_http_timeouts,
+    comfy_spool_max_size,
+)
 
+logger = logging.getLogger(__name__)
 
-def get_address():
-    return "http://{}".format(server_ip)
 
+class ComfyClient:
+    """Long-lived HTTP client for a ComfyUI server.
 
-async def queue_prompt(prompt):
-    p = {"prompt": prompt, "client_id": client_id}
-    data = json.dumps(p).encode("utf-8")
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{get_address()}/prompt", data=data, headers={'Content-Type': 'application/json'}) as response:
-            response.raise_for_status()
+    Keeps a single aiohttp session with a keep-alive connection pool so jobs
+    reuse sockets instead of connecting for every request.
+    """
+
+    def __init__(self, address, connection_limit=None, keepalive=None, timeouts=None):
+        self.address = address
+        self.connection_limit = connection_limit or comfy_http_connection_limit
+        self.keepalive = keepalive or comfy_http_keepalive
+        self.timeouts = {**comfy_http_timeouts, **(timeouts or {})}
+        self.session = None
+        self.session_lock = asyncio.Lock()
+
+    def get_address(self):
+        return "http://{}".format(self.address)
+
+    async def start(self):
+        """Open the pooled session if it is not already open"""
+        async with self.session_lock:
+            if self.session is not None and not self.session.closed:
+                return self.session
+
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                limit_per_host=self.connection_limit,
+                keepalive_timeout=self.keepalive,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                raise_for_status=True,
+            )
+            logger.info(f"ComfyUI HTTP client started for {self.address}")
+            return self.session
+
+    async def close(self):
+        """Close the pooled session and release its connections"""
+        async with self.session_lock:
+            if self.session is None or self.session.closed:
+                return
+            await self.session.close()
+            self.session = None
+            logger.info(f"ComfyUI HTTP client closed for {self.address}")
+
+    async def get_session(self):
+        if self.session is None or self.session.closed:
+            return await self.start()
+        return self.session
+
+    def get_timeout(self, endpoint):
+        return aiohttp.ClientTimeout(total=self.timeouts.get(endpoint))
+
+    async def queue_prompt(self, prompt, prompt_id=None):
+        p = {"prompt": prompt, "client_id": client_id}
+        if prompt_id:
+            p["prompt_id"] = prompt_id
+        data = json.dumps(p).encode("utf-8")
+
+        session = await self.get_session()
+        async with session.post(
+            f"{self.get_address()}/prompt",
+            data=data,
+            headers={'Content-Type': 'application/json'},
+            timeout=self.get_timeout("prompt"),
+        ) as response:
             return await response.json()
 
+    async def get_system_info(self):
+        session = await self.get_session()
+        async with session.get(
+            f"{self.get_address()}/object_info",
+            timeout=self.get_timeout("object_info"),
+        ) as response:
+            return await response.json()
 
-async def get_system_info():
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{get_address()}/object_info") as response:
-            response.raise_for_status()
+    async def get_queue(self):
+        session = await self.get_session()
+        async with session.get(
+            f"{self.get_address()}/queue",
+            timeout=self.get_timeout("queue"),
+        ) as response:
             return await response.json()
 
+    async def delete_queued(self, prompt_ids):
+        """Remove prompts that have not started from the queue"""
+        session = await self.get_session()
+        async with session.post(
+            f"{self.get_address()}/queue",
+            json={"delete": list(prompt_ids)},
+            timeout=self.get_timeout("queue"),
+        ):
+            pass
+
+    async def interrupt(self, prompt_id=None):
+        """Stop the running prompt. Newer servers only stop it if it is prompt_id"""
+        session = await self.get_session()
+        async with session.post(
+            f"{self.get_address()}/interrupt",
+            json={"prompt_id": prompt_id} if prompt_id else {},
+            timeout=self.get_timeout("queue"),
+        ):
+            pass
 
-async def get_history(prompt_id):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{get_address()}/history/{prompt_id}") as response:
-            response.raise_for_status()
+    async def get_history(self, prompt_id):
+        session = await self.get_session()
+        async with session.get(
+            f"{self.get_address()}/history/{prompt_id}",
+            timeout=self.get_timeout("history"),
+        ) as response:
             return await response.json()
 
+    async def get_image_file(self, filename, subfolder, folder_type, spool_max_size=None):
+        """Stream an output image into a file object.
+
+        Small images stay in memory. Anything larger than spool_max_size is
+        written to a temporary file on disk instead. The returned file is
+        positioned at the start and owned by the caller.
+        """
+        data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        url_values = urllib.parse.urlencode(data)
+
+        session = await self.get_session()
+        async with session.get(
+            f"{self.get_address()}/view?{url_values}",
+            timeout=self.get_timeout("view"),
+        ) as response:
+            return await spool_response(response, spool_max_size)
+
+    async def upload_image(self, file, filename, overwrite=True):
+        """Upload an input image with a multipart POST to /upload/image.
+
+        The file object is streamed rather than read into memory. Returns
+        ComfyUI's response, which holds the stored name and subfolder.
+        """
+        form = aiohttp.FormData()
+        form.add_field("image", file, filename=filename, content_type="application/octet-stream")
+        form.add_field("overwrite", "true" if overwrite else "false")
+
+        session = await self.get_session()
+        async with session.post(
+            f"{self.get_address()}/upload/image",
+            data=form,
+            timeout=self.get_timeout("upload"),
+        ) as response:
+            return await response.json()
+
+
+async def spool_response(response, spool_max_size=None, digest=None):
+    """Stream an HTTP response body into a file object.
+
+    Bodies up to spool_max_size stay in memory, larger ones go to a
+    temporary file. If digest is a hashlib object it is updated with the
+    body. The returned file is positioned at the start.
+    """
+    spool_max_size = spool_max_size or comfy_spool_max_size
+    if response.content_length and response.content_length > spool_max_size:
+        body_file = tempfile.TemporaryFile()
+    else:
+        body_file = io.BytesIO()
+
+    try:
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            if isinstance(body_file, io.BytesIO) and body_file.tell() + len(chunk) > spool_max_size:
+                # Roll the in-memory buffer over to disk once it gets too big.
+                spooled_file = tempfile.TemporaryFile()
+                spooled_file.write(body_file.getbuffer())
+                body_file = spooled_file
+            body_file.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+    except BaseException:
+        body_file.close()
+        raise
 
-async def get_image(filename, subfolder, folder_type):
-    data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url_values = urllib.parse.urlencode(data)
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{get_address()}/view?{url_values}") as response:
-            response.raise_for_status()
-            return await response.read()
+    body_file.seek(0)
+    return body_file
@@ -1,71 +1,292 @@
+import asyncio
+import copy
 import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from models.sd_options import SDOptions
+from utils.logging_config import get_logger
 
-_conn = sqlite3.connect("job.db")
+logger = get_logger(__name__)
 
+DATABASE_PATH = "job.db"
 
-def init_db():
-    _conn.cursor().execute(
-        "CREATE TABLE IF NOT EXISTS job (id INTEGER PRIMARY KEY AUTOINCREMENT, data json);"
-    )
-    _conn.cursor().execute(
-        "CREATE TABLE IF NOT EXISTS fluxjob (id INTEGER PRIMARY KEY AUTOINCREMENT, prompt TEXT);"
-    )
-    _conn.cursor().execute(
-        "CREATE TABLE IF NOT EXISTS videojob (id INTEGER PRIMARY KEY AUTOINCREMENT, prompt TEXT);"
-    )
-    _conn.cursor().execute(
-        "CREATE TABLE IF NOT EXISTS editjob (id INTEGER PRIMARY KEY AUTOINCREMENT, prompt TEXT, image_url TEXT);"
-    )
+# Most rows written in a single group commit.
+MAX_BATCH_SIZE = 256
+# Seconds to wait before retrying a failed commit, doubling up to the max.
+WRITE_RETRY_DELAY = 0.5
+MAX_WRITE_RETRY_DELAY = 30
+# Deserialized jobs and message links kept in memory.
+JOB_CACHE_SIZE = 256
+MESSAGE_CACHE_SIZE = 1024
+
+_TABLE_COLUMNS = {
+    "job": ("data",),
+    "fluxjob": ("prompt",),
+    "videojob": ("prompt",),
+    "editjob": ("prompt", "image_url"),
+    # Keyed by Discord message ID rather than a generated ID.
+    "message_job": ("kind", "job_id"),
+}
+_JOB_TABLES = ("job", "fluxjob", "videojob", "editjob")
+
+
+class JobStore:
+    """WAL-mode job database with a batched background writer.
+
+    IDs are handed out from an in-memory counter so callers never wait on a
+    commit. Rows queued for writing stay readable from memory until the
+    writer task has committed them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-db-writer")
+        self.read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-db-reader")
+        self.write_conn = None
+        self.read_conn = None
+        self.next_ids = {}
+        self.pending = {}  # (table, id) -> values not yet committed
+        self.queue = None
+        self.writer_task = None
+
+    async def start(self):
+        """Create tables, load ID counters and start the writer task"""
+        if self.writer_task is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+        self.next_ids = await loop.run_in_executor(self.write_executor, self._open_writer)
+        await loop.run_in_executor(self.read_executor, self._open_reader)
+        self.queue = asyncio.Queue()
+        self.writer_task = loop.create_task(self._write_loop())
+        logger.info("Job database writer started")
+
+    async def close(self):
+        """Flush queued rows and close the database"""
+        if self.writer_task is None:
+            return
+
+        await self.queue.put(None)
+        await self.writer_task
+        self.writer_task = None
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.write_executor, self.write_conn.close)
+        await loop.run_in_executor(self.read_executor, self.read_conn.close)
+        logger.info("Job database closed")
+
+    def add(self, table, values):
+        """Queue a row for writing and return its ID immediately"""
+        if self.writer_task is None:
+            raise RuntimeError("Job database is not initialized")
+
+        row_id = self.next_ids[table]
+        self.next_ids[table] += 1
+        self.put(table, row_id, values)
+        return row_id
+
+    def put(self, table, row_id, values):
+        """Queue a row with a caller-chosen ID, replacing any existing row"""
+        if self.writer_task is None:
+            raise RuntimeError("Job database is not initialized")
+
+        self.pending[(table, row_id)] = values
+        self.queue.put_nowait((table, row_id, values))
+
+    async def get(self, table, row_id):
+        """Read a row's values, including rows that are not committed yet"""
+        row_id = int(row_id)
+        values = self.pending.get((table, row_id))
+        if values is not None:
+            return values
+
+        columns = ", ".join(_TABLE_COLUMNS[table])
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.read_executor,
+            self._fetch_one,
+            f"SELECT {columns} FROM {table} WHERE id=?",
+            (row_id,),
+        )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _open_writer(self):
+        self.write_conn = self._connect()
+        self.write_conn.execute(
+            "CREATE TABLE IF NOT EXISTS job (id INTEGER PRIMARY KEY AUTOINCREMENT, data json);"
+        )
+        self.write_conn.execute(
+            "CREATE TABLE IF NOT EXISTS fluxjob (id INTEGER PRIMARY KEY AUTOINCREMENT, prompt TEXT);"
+        )
+        self.write_conn.execute(
+            "CREATE TABLE IF NOT EXISTS videojob (id INTEGER PRIMARY KEY AUTOINCREMENT, prompt TEXT);"
+        )
+        self.write_conn.execute(
+            "CREATE TABLE IF NOT EXISTS editjob (id INTEGER PRIMARY KEY AUTOINCREMENT, prompt TEXT, image_url TEXT);"
+        )
+        self.write_conn.execute(
+            "CREATE TABLE IF NOT EXISTS message_job (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, job_id INTEGER NOT NULL);"
+        )
+        self.write_conn.commit()
+
+        next_ids = {}
+        for table in _JOB_TABLES:
+            max_id = self.write_conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+            row = self.write_conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name=?", (table,)
+            ).fetchone()
+            next_ids[table] = max(max_id, row[0] if row else 0) + 1
+        return next_ids
+
+    def _open_reader(self):
+        self.read_conn = self._connect()
+
+    def _fetch_one(self, query, params):
+        row = self.read_conn.execute(query, params).fetchone()
+        return tuple(row) if row is not None else None
+
+    def _write_batch(self, batch):
+        rows_by_table = {}
+        for table, row_id, values in batch:
+            rows_by_table.setdefault(table, []).append((row_id, *values))
+
+        with self.write_conn:
+            for table, rows in rows_by_table.items():
+                columns = _TABLE_COLUMNS[table]
+                placeholders = ", ".join("?" for _ in range(len(columns) + 1))
+                self.write_conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} (id, {', '.join(columns)}) VALUES ({placeholders})",
+                    rows,
+                )
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        batch = []  # rows to commit, kept across failed commits
+        retry_delay = WRITE_RETRY_DELAY
+        while True:
+            if not batch and not stopping:
+                item = await self.queue.get()
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+            # Group everything that queued up while the last commit ran.
+            while not stopping and len(batch) < MAX_BATCH_SIZE and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            if not batch:
+                if stopping:
+                    return
+                continue
+
+            try:
+                await loop.run_in_executor(self.write_executor, self._write_batch, batch)
+            except Exception as e:
+                if stopping:
+                    logger.error(f"Failed to write {len(batch)} job rows while closing, they are lost: {e}")
+                    return
+                logger.error(f"Failed to write {len(batch)} job rows, retrying in {retry_delay:g}s: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_WRITE_RETRY_DELAY)
+                continue
+
+            logger.debug(f"Committed {len(batch)} job rows")
+            for table, row_id, values in batch:
+                # A newer value may have been queued for the row during the commit.
+                if self.pending.get((table, row_id)) is values:
+                    del self.pending[(table, row_id)]
+            batch = []
+            retry_delay = WRITE_RETRY_DELAY
+
+
+# Global instance
+_store = JobStore(DATABASE_PATH)
+
+
+async def init_db():
+    await _store.start()
+
+
+async def close_db():
+    await _store.close()
+
+
+_job_cache = OrderedDict()  # job id -> SDOptions
+_message_cache = OrderedDict()  # message id -> (kind, job id)
+
+
+def _remember(cache, key, value, max_size):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > max_size:
+        cache.popitem(last=False)
 
 
 def add_job(sd_options: SDOptions):
-    c = _conn.cursor()
-    c.execute("INSERT INTO job (data) VALUES (?)", (sd_options.to_json(),))
-    _conn.commit()
+    job_id = _store.add("job", (sd_options.to_json(),))
+    _remember(_job_cache, job_id, copy.copy(sd_options), JOB_CACHE_SIZE)
+    return job_id
 
-    return c.lastrowid
 
+async def get_job(id: str) -> SDOptions:
+    """Options of a draw job. Returns a copy the caller may modify."""
+    job_id = int(id)
+    sd_options = _job_cache.get(job_id)
+    if sd_options is None:
+        row = await _store.get("job", job_id)
+        sd_options = SDOptions.from_json(row[0])
+    _remember(_job_cache, job_id, sd_options, JOB_CACHE_SIZE)
+    return copy.copy(sd_options)
 
-def get_job(id: str) -> SDOptions:
-    c = _conn.cursor()
-    c.execute("SELECT data FROM job WHERE id=?", (id,))
-    return SDOptions.from_json(c.fetchone()[0])
 
+def link_message(message_id: int, kind: str, job_id: int):
+    """Record which job a posted result message belongs to.
 
-def add_fluxjob(prompt: str):
-    c = _conn.cursor()
-    c.execute("INSERT INTO fluxjob (prompt) VALUES (?)", (prompt,))
-    _conn.commit()
+    kind is the job table: job, fluxjob, videojob or editjob.
+    """
+    _store.put("message_job", message_id, (kind, job_id))
+    _remember(_message_cache, message_id, (kind, job_id), MESSAGE_CACHE_SIZE)
 
-    return c.lastrowid
 
-def get_fluxjob(id: str) -> SDOptions:
-    c = _conn.cursor()
-    c.execute("SELECT prompt FROM fluxjob WHERE id=?", (id,))
-    return c.fetchone()[0]
+async def get_message_job(message_id: int):
+    """(kind, job id) for a result message, or None if it was never linked"""
+    link = _message_cache.get(message_id)
+    if link is None:
+        row = await _store.get("message_job", message_id)
+        if row is None:
+            return None
+        link = (row[0], row[1])
+    _remember(_message_cache, message_id, link, MESSAGE_CACHE_SIZE)
+    return link
 
-def add_videojob(prompt: str):
-    c = _conn.cursor()
-    c.execute("INSERT INTO videojob (prompt) VALUES (?)", (prompt,))
-    _conn.commit()
 
-    return c.lastrowid
+def add_fluxjob(prompt: str):
+    return _store.add("fluxjob", (prompt,))
 
-def get_videojob(id: str) -> SDOptions:
-    c = _conn.cursor()
-    c.execute("SELECT prompt FROM videojob WHERE id=?", (id,))
-    return c.fetchone()[0]
+async def get_fluxjob(id: str) -> str:
+    row = await _store.get("fluxjob", id)
+    return row[0]
 
-def add_editjob(prompt: str, image_url: str):
-    c = _conn.cursor()
-    c.execute("INSERT INTO editjob (prompt, image_url) VALUES (?, ?)", (prompt, image_url))
-    _conn.commit()
+def add_videojob(prompt: str):
+    return _store.add("videojob", (prompt,))
 
-    return c.lastrowid
+async def get_videojob(id: str) -> str:
+    row = await _store.get("videojob", id)
+    return row[0]
+
+def add_editjob(prompt: str, image_url: str):
+    return _store.add("editjob", (prompt, image_url))
 
-def get_editjob(id: str):
-    c = _conn.cursor()
-    c.execute("SELECT prompt, image_url FROM editjob WHERE id=?", (id,))
-    result = c.fetchone()
-    return {"prompt": result[0], "image_url": result[1]}
+async def get_editjob(id: str):
+    row = await _store.get("editjob", id)
+    return {"prompt": row[0], "image_url": row[1]}
@@ -0,0 +1,197 @@
+import asyncio
+import time
+from collections import OrderedDict, deque, Counter
+from enum import Enum
+from utils.logging_config import get_logger
+from settings import scheduler_max_running, scheduler_user_cap, scheduler_priority_weights
+
+logger = get_logger(__name__)
+
+
+class Priority(Enum):
+    INTERACTIVE = 1
+    BACKGROUND = 2
+
+
+class JobTicket:
+    """A job waiting for, or holding, a ComfyUI submission slot"""
+
+    def __init__(self, user_id, guild_id, priority: Priority):
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class JobScheduler:
+    """Holds pending ComfyUI jobs and releases them fairly.
+
+    Priority lanes are served by weighted round robin. Inside a lane, guilds
+    take turns, and inside a guild, users take turns. A user is skipped while
+    they are at their concurrency cap.
+    """
+
+    def __init__(self, max_running=None, user_cap=None, priority_weights=None):
+        self.max_running = max_running or scheduler_max_running
+        self.default_user_cap = user_cap or scheduler_user_cap
+        self.user_caps = {}
+        self.weights = {
+            priority: (priority_weights or scheduler_priority_weights).get(priority.name, 1)
+            for priority in Priority
+        }
+        self.credits = dict(self.weights)
+        # priority -> guild_id -> user_id -> tickets
+        self.lanes = {priority: OrderedDict() for priority in Priority}
+        # The guild last served in each lane, and the user last served in
+        # each guild, so newcomers are queued ahead of them. Kept after their
+        # tickets run out, as they may queue again straight away.
+        self.last_guild = {}  # priority -> guild_id
+        self.last_user = {}  # (priority, guild_id) -> user_id
+        self.running = 0
+        self.running_by_user = Counter()
+        self.average_wait = {priority: 0.0 for priority in Priority}
+
+    async def acquire(self, user_id=None, guild_id=None, priority=Priority.INTERACTIVE) -> JobTicket:
+        """Wait until the job may be submitted to ComfyUI"""
+        ticket = JobTicket(user_id, guild_id, priority)
+        guild_lanes = self.lanes[priority]
+        guild_lane = guild_lanes.get(guild_id)
+        if guild_lane is None:
+            guild_lane = guild_lanes[guild_id] = OrderedDict()
+            self._keep_last_served_behind(guild_lanes, self.last_guild, priority)
+        tickets = guild_lane.get(user_id)
+        if tickets is None:
+            tickets = guild_lane[user_id] = deque()
+            self._keep_last_served_behind(guild_lane, self.last_user, (priority, guild_id))
+        tickets.append(ticket)
+        self._dispatch()
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                self.release(ticket)
+            else:
+                self._remove(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: JobTicket):
+        """Give back the slot held by a finished job"""
+        self.running -= 1
+        self.running_by_user[ticket.user_id] -= 1
+        if self.running_by_user[ticket.user_id] <= 0:
+            del self.running_by_user[ticket.user_id]
+        self._dispatch()
+
+    def get_user_cap(self, user_id):
+        return self.user_caps.get(user_id, self.default_user_cap)
+
+    def set_user_cap(self, user_id, cap):
+        """Change a user's concurrency cap. None resets it to the default."""
+        if cap is None:
+            self.user_caps.pop(user_id, None)
+        else:
+            self.user_caps[user_id] = cap
+        self._dispatch()
+
+    def set_default_user_cap(self, cap):
+        self.default_user_cap = cap
+        self._dispatch()
+
+    def set_max_running(self, max_running):
+        self.max_running = max_running
+        self._dispatch()
+
+    def stats(self):
+        """Queue depth and waits for each priority lane"""
+        now = time.monotonic()
+        lanes = {}
+        for priority, guild_lanes in self.lanes.items():
+            tickets = [
+                ticket
+                for user_lanes in guild_lanes.values()
+                for user_tickets in user_lanes.values()
+                for ticket in user_tickets
+            ]
+            lanes[priority.name] = {
+                "depth": len(tickets),
+                "oldest_wait": max((now - ticket.enqueued_at for ticket in tickets), default=0.0),
+                "average_wait": self.average_wait[priority],
+            }
+        return {
+            "running": self.running,
+            "max_running": self.max_running,
+            "default_user_cap": self.default_user_cap,
+            "lanes": lanes,
+        }
+
+    def _dispatch(self):
+        while self.running < self.max_running:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+
+            self.running += 1
+            self.running_by_user[ticket.user_id] += 1
+            wait = time.monotonic() - ticket.enqueued_at
+            self.average_wait[ticket.priority] = self.average_wait[ticket.priority] * 0.8 + wait * 0.2
+            logger.debug(f"Releasing {ticket.priority.name} job for user {ticket.user_id} after {wait:.2f}s")
+            ticket.future.set_result(None)
+
+    def _next_ticket(self):
+        for _ in range(2):
+            for priority in Priority:
+                if self.credits[priority] <= 0:
+                    continue
+                ticket = self._pop_from_lane(priority)
+                if ticket:
+                    self.credits[priority] -= 1
+                    return ticket
+            # Every lane with waiting jobs is out of credits, start a new round.
+            self.credits = dict(self.weights)
+        return None
+
+    @staticmethod
+    def _keep_last_served_behind(lanes, last_served, key):
+        """Move the last served entry behind one just added, so it waits its turn"""
+        if key in last_served and last_served[key] in lanes:
+            lanes.move_to_end(last_served[key])
+
+    def _pop_from_lane(self, priority):
+        guild_lanes = self.lanes[priority]
+        for guild_id, user_lanes in guild_lanes.items():
+            for user_id, tickets in user_lanes.items():
+                if self.running_by_user[user_id] >= self.get_user_cap(user_id):
+                    continue
+
+                ticket = tickets.popleft()
+                # Rotate the user and guild to the back for round robin.
+                if tickets:
+                    user_lanes.move_to_end(user_id)
+                else:
+                    del user_lanes[user_id]
+                if user_lanes:
+                    guild_lanes.move_to_end(guild_id)
+                else:
+                    del guild_lanes[guild_id]
+                self.last_guild[priority] = guild_id
+                self.last_user[(priority, guild_id)] = user_id
+                return ticket
+        return None
+
+    def _remove(self, ticket: JobTicket):
+        guild_lanes = self.lanes[ticket.priority]
+        user_lanes = guild_lanes.get(ticket.guild_id, {})
+        tickets = user_lanes.get(ticket.user_id)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del user_lanes[ticket.user_id]
+            if not user_lanes:
+                del guild_lanes[ticket.guild_id]
+
+
+# Global instance
+job_scheduler = JobScheduler()
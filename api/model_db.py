@@ -1,9 +1,22 @@
-import aiosqlite
+from api.sqlite_manager import SQLiteManager
+from models.preview_mode import PreviewMode
+from settings import preview_default_mode
 
 DATABASE_PATH = "model.db"
 
+_db = SQLiteManager(DATABASE_PATH)
+
+# In-process copies of the defaults tables. Writes below update them as soon
+# as they commit so draws never need to query the database.
+_sd_defaults = {}  # sd_type -> row
+_model_defaults = {}  # model -> row
+_merged_defaults = {}  # (sd_type, model) -> sd type defaults overlaid with model defaults
+_guild_preview_modes = {}  # guild_id -> PreviewMode
+_defaults_loaded = False
+
+
 async def init_model_db():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _db.transaction() as db:
         await db.execute(
                """
                CREATE TABLE IF NOT EXISTS model_defaults (
@@ -45,89 +58,161 @@ async def init_model_db():
             );
                """
         )
-        await db.commit()
+        await db.execute(
+               """
+               CREATE TABLE IF NOT EXISTS guild_preview (
+               guild_id INTEGER PRIMARY KEY,
+               mode TEXT NOT NULL
+            );
+               """
+        )
+    await _load_defaults()
+
+
+async def _load_defaults():
+    global _defaults_loaded
+    sd_rows = await _db.fetchall("SELECT * FROM sd_defaults")
+    model_rows = await _db.fetchall("SELECT * FROM model_defaults")
+    _sd_defaults.clear()
+    _sd_defaults.update({row["sd_type"]: dict(row) for row in sd_rows})
+    _model_defaults.clear()
+    _model_defaults.update({row["model"]: dict(row) for row in model_rows})
+    _rebuild_merged_defaults()
+    preview_rows = await _db.fetchall("SELECT guild_id, mode FROM guild_preview")
+    _guild_preview_modes.clear()
+    _guild_preview_modes.update({row["guild_id"]: PreviewMode(row["mode"]) for row in preview_rows})
+    _defaults_loaded = True
+
+
+def _merge_defaults(sd_type, model):
+    sd_default = _sd_defaults.get(sd_type, {})
+    model_default = _model_defaults.get(model or sd_default.get("model"), {})
+    return {
+        param: model_default.get(param) if model_default.get(param) is not None else sd_default.get(param)
+        for param in {**sd_default, **model_default}
+    }
+
+
+def _rebuild_merged_defaults():
+    _merged_defaults.clear()
+    for sd_type in _sd_defaults:
+        for model in [None, *_model_defaults]:
+            _merged_defaults[(sd_type, model)] = _merge_defaults(sd_type, model)
+
+
+async def get_merged_defaults(sd_type, model):
+    """Defaults for a draw, with model defaults taking precedence.
+
+    The returned dict is shared and must not be modified.
+    """
+    if not _defaults_loaded:
+        await _load_defaults()
+
+    key = (sd_type, model)
+    merged = _merged_defaults.get(key)
+    if merged is None:
+        merged = _merged_defaults[key] = _merge_defaults(sd_type, model)
+    return merged
+
+
+async def close_model_db():
+    await _db.close()
+
 
 async def get_model_default(model):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM model_defaults WHERE model = ?", (model,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row is not None else dict()
+    if not _defaults_loaded:
+        await _load_defaults()
+    return dict(_model_defaults.get(model, {}))
 
 async def get_sd_default(sd_type):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM sd_defaults WHERE sd_type = ?", (sd_type,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row is not None else dict()
+    if not _defaults_loaded:
+        await _load_defaults()
+    return dict(_sd_defaults.get(sd_type, {}))
+
+
+def get_guild_preview_mode(guild_id) -> PreviewMode:
+    """Progress preview mode of a guild, or the configured default"""
+    mode = _guild_preview_modes.get(guild_id)
+    if mode is None:
+        return PreviewMode(preview_default_mode)
+    return mode
+
+
+async def set_guild_preview_mode(guild_id, mode: PreviewMode):
+    await _db.execute(
+        """
+        INSERT INTO guild_preview (guild_id, mode) VALUES (?, ?)
+        ON CONFLICT(guild_id) DO UPDATE SET mode=excluded.mode;
+        """,
+        (guild_id, mode.value)
+    )
+    _guild_preview_modes[guild_id] = mode
 
 
 async def upsert_model_default(model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO model_defaults (model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(model) DO UPDATE SET
-                prompt_template=excluded.prompt_template,
-                negative_prompt=excluded.negative_prompt,
-                width=excluded.width,
-                height=excluded.height,
-                steps=excluded.steps,
-                cfg=excluded.cfg,
-                sampler=excluded.sampler,
-                scheduler=excluded.scheduler,
-                hires=excluded.hires,
-                hires_strength=excluded.hires_strength;
-            """,
-            (model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength)
-        )
-        await db.commit()
+    await _db.execute(
+        """
+        INSERT INTO model_defaults (model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(model) DO UPDATE SET
+            prompt_template=excluded.prompt_template,
+            negative_prompt=excluded.negative_prompt,
+            width=excluded.width,
+            height=excluded.height,
+            steps=excluded.steps,
+            cfg=excluded.cfg,
+            sampler=excluded.sampler,
+            scheduler=excluded.scheduler,
+            hires=excluded.hires,
+            hires_strength=excluded.hires_strength;
+        """,
+        (model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength)
+    )
+    row = await _db.fetchone("SELECT * FROM model_defaults WHERE model = ?", (model,))
+    _model_defaults[model] = dict(row)
+    _rebuild_merged_defaults()
 
 async def upsert_sd_default(sd_type, model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO sd_defaults (sd_type, model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(sd_type) DO UPDATE SET
-                model=excluded.model,
-                prompt_template=excluded.prompt_template,
-                negative_prompt=excluded.negative_prompt,
-                width=excluded.width,
-                height=excluded.height,
-                steps=excluded.steps,
-                cfg=excluded.cfg,
-                sampler=excluded.sampler,
-                scheduler=excluded.scheduler,
-                hires=excluded.hires,
-                hires_strength=excluded.hires_strength;
-            """,
-            (sd_type, model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength)
-        )
-        await db.commit()
+    await _db.execute(
+        """
+        INSERT INTO sd_defaults (sd_type, model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(sd_type) DO UPDATE SET
+            model=excluded.model,
+            prompt_template=excluded.prompt_template,
+            negative_prompt=excluded.negative_prompt,
+            width=excluded.width,
+            height=excluded.height,
+            steps=excluded.steps,
+            cfg=excluded.cfg,
+            sampler=excluded.sampler,
+            scheduler=excluded.scheduler,
+            hires=excluded.hires,
+            hires_strength=excluded.hires_strength;
+        """,
+        (sd_type, model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength)
+    )
+    row = await _db.fetchone("SELECT * FROM sd_defaults WHERE sd_type = ?", (sd_type,))
+    _sd_defaults[sd_type] = dict(row)
+    _rebuild_merged_defaults()
 
 async def delete_model_default(model):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            """
-            DELETE FROM model_defaults WHERE model = ?;
-            """,
-            (model,)
-        )
-        await db.commit()
+    await _db.execute(
+        """
+        DELETE FROM model_defaults WHERE model = ?;
+        """,
+        (model,)
+    )
+    _model_defaults.pop(model, None)
+    _rebuild_merged_defaults()
 
 
 async def delete_sd_default(sd_type):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            """
-            DELETE FROM sd_defaults WHERE sd_type = ?;
-            """,
-            (sd_type,)
-        )
-        await db.commit()
+    await _db.execute(
+        """
+        DELETE FROM sd_defaults WHERE sd_type = ?;
+        """,
+        (sd_type,)
+    )
+    _sd_defaults.pop(sd_type, None)
+    _rebuild_merged_defaults()
@@ -1,10 +1,19 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from openai import AsyncOpenAI
 from api.chat_history_db import (
     get_server_prompt,
     get_user_prompt,
+    get_prompt_versions,
     get_chat_history,
+    get_uncounted_chats,
+    get_truncation_point,
     insert_chat_history,
-    delete_single_chat,
+    update_token_counts,
+    delete_chats_through,
 )
 import tiktoken
 from settings import openai_api_key, openai_model, openai_truncate_limit
@@ -14,49 +23,111 @@ logger = get_logger(__name__)
 client = AsyncOpenAI(api_key=openai_api_key)
 
 
-async def get_system_prompt():
-    with open("system_prompt.txt", "r") as file:
-        return (file.read()).strip()
+SYSTEM_PROMPT_PATH = "system_prompt.txt"
+# Seconds between checks of system_prompt.txt for changes.
+SYSTEM_PROMPT_CHECK_INTERVAL = 5
+# Most (server, user) prompt compositions kept in memory.
+MAX_PROMPT_CACHE_SIZE = 1024
 
+_system_prompt = None
+_system_prompt_mtime = None
+_system_prompt_checked_at = 0.0
+_prompt_cache = OrderedDict()  # (server_id, user_id, username) -> (stamp, system messages)
 
-async def truncate_history(server_id, max_tokens):
-    # Get the full chat history for the server
-    chat_history = await get_chat_history(server_id)
-    messages = [message or "" for message, _ in chat_history]
 
-    # Convert the chat history into a single string to count tokens
-    history_str = " ".join(messages)
-    encoding = tiktoken.encoding_for_model(openai_model)
-    tokens = len(encoding.encode(history_str))
-    # If the token limit is exceeded, remove the oldest messages
-    while tokens > max_tokens and chat_history:
-        # Remove the oldest entry (first in the list)
-        oldest_message = chat_history.pop(0)
-        logger.debug(f"Removing oldest message: {oldest_message[0][:50]}...")
-        await delete_single_chat(server_id, oldest_message[0], oldest_message[1])
+def get_system_prompt():
+    """Contents of system_prompt.txt, reread only when the file changes"""
+    global _system_prompt, _system_prompt_mtime, _system_prompt_checked_at
+    now = time.monotonic()
+    if _system_prompt is not None and now - _system_prompt_checked_at < SYSTEM_PROMPT_CHECK_INTERVAL:
+        return _system_prompt
 
-        # Recalculate the token count
-        history_str = " ".join([message or "" for message, _ in chat_history])
-        tokens = len(encoding.encode(history_str))
+    _system_prompt_checked_at = now
+    mtime = os.stat(SYSTEM_PROMPT_PATH).st_mtime_ns
+    if mtime != _system_prompt_mtime:
+        with open(SYSTEM_PROMPT_PATH, "r") as file:
+            _system_prompt = file.read().strip()
+        _system_prompt_mtime = mtime
+        logger.info("Loaded system prompt")
+    return _system_prompt
 
 
-# Example of sending a message and updating chat history in the database
-async def send_message(server_id, user_id, username, prompt, b64_image):
-    system_prompt = await get_system_prompt()
-    server_prompt = await get_server_prompt(server_id)
-    user_prompt = await get_user_prompt(user_id)
+async def get_system_messages(server_id, user_id, username):
+    """System messages for a chat as (prefix, memory).
+
+    The prefix only depends on the bot and server prompts so every request in
+    a server starts with the same tokens. The user's memory is returned
+    separately to go after the history, or None if they have none.
+    """
+    system_prompt = get_system_prompt()
+    stamp = (_system_prompt_mtime, *get_prompt_versions(server_id, user_id))
+    key = (server_id, user_id, username)
+    cached = _prompt_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        _prompt_cache.move_to_end(key)
+        return cached[1]
+
+    server_prompt, user_prompt = await asyncio.gather(
+        get_server_prompt(server_id), get_user_prompt(user_id)
+    )
+    logger.debug(f"System prompt: {server_prompt[:100]}...")
+    logger.debug(f"User prompt: {user_prompt[:100]}...")
     if server_prompt:
         system_prompt = system_prompt + "\n" + server_prompt
+    memory_prompt = None
     if user_prompt:
-        system_prompt = (
-            system_prompt
-            + "\n"
-            + f"Here are items {username} wants you to remember\n{user_prompt}\nWhen interacting with {username} keep those items in mind."
-        )
-    logger.debug(f"System prompt: {server_prompt[:100]}...")
-    logger.debug(f"User prompt: {user_prompt[:100]}...")
+        memory_prompt = f"Here are items {username} wants you to remember\n{user_prompt}\nWhen interacting with {username} keep those items in mind."
+
+    system_messages = (
+        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": memory_prompt} if memory_prompt else None,
+    )
+    _prompt_cache[key] = (stamp, system_messages)
+    if len(_prompt_cache) > MAX_PROMPT_CACHE_SIZE:
+        _prompt_cache.popitem(last=False)
+    return system_messages
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def _count_tokens(texts):
+    encoding = get_encoding(openai_model)
+    return [len(encoding.encode(text or "")) for text in texts]
+
+
+async def count_tokens(*texts):
+    """Token counts for each text, encoded off the event loop"""
+    return await asyncio.to_thread(_count_tokens, texts)
+
+
+async def truncate_history(server_id, max_tokens):
+    # Rows written before token counts were stored are counted once here.
+    missing = await get_uncounted_chats(server_id)
+    if missing:
+        counted = await count_tokens(*[message for _, message in missing])
+        await update_token_counts(zip([chat_id for chat_id, _ in missing], counted))
+
+    # Drop the oldest messages, up to the point where the rest fits, in one delete
+    chat_id = await get_truncation_point(server_id, max_tokens)
+    if chat_id is None:
+        return
+    logger.debug(f"Removing messages through {chat_id} from server {server_id}")
+    await delete_chats_through(server_id, chat_id)
+
+
+async def _build_messages(server_id, user_id, username, prompt, b64_image):
+    prefix_message, memory_message = await get_system_messages(server_id, user_id, username)
     chat_history = await get_chat_history(server_id)
-    messages = [{"role": role, "content": message or ""} for message, role in chat_history]
+    messages = [prefix_message]
+    messages.extend({"role": role, "content": message or ""} for _, message, role in chat_history)
+    if memory_message:
+        messages.append(memory_message)
     if b64_image:
         messages.append(
             {
@@ -72,16 +143,59 @@ async def send_message(server_id, user_id, username, prompt, b64_image):
         )
     else:
         messages.append({"role": "user", "content": prompt or ""})
+    return messages
+
+
+async def _save_exchange(server_id, prompt, assistant_message):
+    prompt_tokens, assistant_tokens = await count_tokens(prompt, assistant_message)
+    await insert_chat_history(server_id, prompt, "user", prompt_tokens)
+    await insert_chat_history(server_id, assistant_message, "assistant", assistant_tokens)
+    await truncate_history(server_id, openai_truncate_limit)
+
+
+# Example of sending a message and updating chat history in the database
+async def send_message(server_id, user_id, username, prompt, b64_image):
+    messages = await _build_messages(server_id, user_id, username, prompt, b64_image)
     model_used = "gpt-4o" if b64_image else openai_model
     logger.debug(f"Using model: {model_used}")
     response = await client.chat.completions.create(
-        model="gpt-4o" if b64_image else openai_model,
-        messages=[{"role": "system", "content": system_prompt}] + messages,
+        model=model_used,
+        messages=messages,
         max_completion_tokens=4096,
     )
     assistant_message = response.choices[0].message.content
     logger.debug(f"Response received, length: {len(assistant_message)} characters")
-    await insert_chat_history(server_id, prompt, "user")
-    await insert_chat_history(server_id, assistant_message, "assistant")
-    await truncate_history(server_id, openai_truncate_limit)
+    await _save_exchange(server_id, prompt, assistant_message)
     return assistant_message
+
+
+async def stream_message(server_id, user_id, username, prompt, b64_image):
+    """Like send_message, but yields the reply in pieces as it is generated.
+
+    The exchange is saved to the chat history once the reply is complete.
+    """
+    messages = await _build_messages(server_id, user_id, username, prompt, b64_image)
+    model_used = "gpt-4o" if b64_image else openai_model
+    logger.debug(f"Streaming with model: {model_used}")
+    stream = await client.chat.completions.create(
+        model=model_used,
+        messages=messages,
+        max_completion_tokens=4096,
+        stream=True,
+    )
+    parts = []
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    finally:
+        # Releases the connection if the caller stops early or fails.
+        await stream.close()
+
+    assistant_message = "".join(parts)
+    logger.debug(f"Stream finished, length: {len(assistant_message)} characters")
+    await _save_exchange(server_id, prompt, assistant_message)
@@ -0,0 +1,75 @@
+import asyncio
+from contextlib import asynccontextmanager
+import aiosqlite
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Prepared statements kept per connection by sqlite3.
+CACHED_STATEMENTS = 256
+
+
+class SQLiteManager:
+    """One long-lived, WAL-enabled aiosqlite connection for a database file.
+
+    Reads share the connection directly. Writes go through transaction(),
+    which serializes them so multi-step operations commit or roll back as a
+    unit.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.open_lock = asyncio.Lock()
+        self.write_lock = asyncio.Lock()
+
+    async def open(self) -> aiosqlite.Connection:
+        """Open the connection if it is not already open"""
+        async with self.open_lock:
+            if self.connection is None:
+                connection = await aiosqlite.connect(self.path, cached_statements=CACHED_STATEMENTS)
+                connection.row_factory = aiosqlite.Row
+                await connection.execute("PRAGMA journal_mode=WAL")
+                await connection.execute("PRAGMA synchronous=NORMAL")
+                self.connection = connection
+                logger.info(f"Opened database {self.path}")
+            return self.connection
+
+    async def close(self):
+        """Close the connection"""
+        async with self.open_lock:
+            if self.connection is not None:
+                await self.connection.close()
+                self.connection = None
+                logger.info(f"Closed database {self.path}")
+
+    async def get(self) -> aiosqlite.Connection:
+        return self.connection or await self.open()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Run several statements in one write transaction"""
+        db = await self.get()
+        async with self.write_lock:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                await db.rollback()
+                raise
+            await db.commit()
+
+    async def execute(self, query, params=()):
+        """Run a single write statement in its own transaction"""
+        async with self.transaction() as db:
+            await db.execute(query, params)
+
+    async def fetchone(self, query, params=()):
+        db = await self.get()
+        async with db.execute(query, params) as cursor:
+            return await cursor.fetchone()
+
+    async def fetchall(self, query, params=()):
+        db = await self.get()
+        async with db.execute(query, params) as cursor:
+            return await cursor.fetchall()
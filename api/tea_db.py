@@ -1,12 +1,18 @@
-import aiosqlite
-
+from api.sqlite_manager import SQLiteManager
 from models.autoreply import GuildAutoReply
 
 DATABASE_PATH = "tea.db"
 
+_db = SQLiteManager(DATABASE_PATH)
+
+# In-memory index of the tables so every incoming message can be checked
+# without touching the database. The toggles keep it in sync.
+_guild_autoreplies = {}  # guild_id -> GuildAutoReply
+_opted_out_users = set()
+
 
 async def init_tea_db():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _db.transaction() as db:
         await db.execute(
             "CREATE TABLE IF NOT EXISTS channels ("
             "guild_id INTEGER NOT NULL,"
@@ -22,37 +28,44 @@ async def init_tea_db():
             "PRIMARY KEY (user_id)"
             ")"
         )
-        await db.commit()
+    await _load_index()
 
 
-async def get_guild_autoreply(guild_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT channel_id, prefix, reverse_check FROM channels WHERE guild_id = ?", (guild_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return GuildAutoReply(row[0], row[1], bool(row[2]))
+async def _load_index():
+    channel_rows = await _db.fetchall("SELECT guild_id, channel_id, prefix, reverse_check FROM channels")
+    opt_out_rows = await _db.fetchall("SELECT user_id FROM opt_out_users")
+    _guild_autoreplies.clear()
+    _guild_autoreplies.update({
+        row[0]: GuildAutoReply(row[1], row[2], bool(row[3])) for row in channel_rows
+    })
+    _opted_out_users.clear()
+    _opted_out_users.update(row[0] for row in opt_out_rows)
 
 
-async def is_user_opt_out(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT user_id FROM opt_out_users WHERE user_id = ?", (user_id,)
-        ) as cursor:
-            return await cursor.fetchone() is not None
+async def close_tea_db():
+    await _db.close()
+
+
+def get_guild_autoreply(guild_id) -> GuildAutoReply | None:
+    """Autoreply config for a guild, or None if autoreply is off"""
+    return _guild_autoreplies.get(guild_id)
+
 
+def is_user_opt_out(user_id):
+    return user_id in _opted_out_users
 
-async def is_guild_autoreply(guild_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+
+def is_guild_autoreply(guild_id):
+    return guild_id in _guild_autoreplies
+
+
+async def toggle_guild_autoreply(guild_id, guild_autoreply: GuildAutoReply):
+    async with _db.transaction() as db:
         async with db.execute(
             "SELECT channel_id FROM channels WHERE guild_id = ?", (guild_id,)
         ) as cursor:
-            return await cursor.fetchone() is not None
-
+            is_guild_autoreplying = await cursor.fetchone() is not None
 
-async def toggle_guild_autoreply(guild_id, guild_autoreply: GuildAutoReply):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        is_guild_autoreplying = await is_guild_autoreply(guild_id)
         if is_guild_autoreplying:
             await db.execute("DELETE FROM channels WHERE guild_id = ?", (guild_id,))
         else:
@@ -60,13 +73,20 @@ async def toggle_guild_autoreply(guild_id, guild_autoreply: GuildAutoReply):
                 "INSERT INTO channels (guild_id, channel_id, prefix, reverse_check) VALUES (?, ?, ?, ?)",
                 (guild_id, guild_autoreply.channel_id, guild_autoreply.prefix, int(guild_autoreply.reverse_check)),
             )
-        await db.commit()
-        return not is_guild_autoreplying
+
+    if is_guild_autoreplying:
+        _guild_autoreplies.pop(guild_id, None)
+    else:
+        _guild_autoreplies[guild_id] = guild_autoreply
+    return not is_guild_autoreplying
 
 
 async def toggle_user_optout(username):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        user_opted_out = await is_user_opt_out(username)
+    async with _db.transaction() as db:
+        async with db.execute(
+            "SELECT user_id FROM opt_out_users WHERE user_id = ?", (username,)
+        ) as cursor:
+            user_opted_out = await cursor.fetchone() is not None
 
         if user_opted_out:
             await db.execute(
@@ -76,6 +96,9 @@ async def toggle_user_optout(username):
             await db.execute(
                 "INSERT INTO opt_out_users (user_id) VALUES (?)", (username,)
             )
-        await db.commit()
 
-        return not user_opted_out
+    if user_opted_out:
+        _opted_out_users.discard(username)
+    else:
+        _opted_out_users.add(username)
+    return not user_opted_out
@@ -1,5 +1,6 @@
 import websockets
 import asyncio
+import json
 import logging
 from settings import server_ip, client_id
 
@@ -9,12 +10,14 @@ logger = logging.getLogger(__name__)
 class WebSocketSubsystem:
     """Simple WebSocket subsystem for ComfyUI connections"""
     
-    def __init__(self):
+    def __init__(self, address=None):
+        self.address = address or server_ip
         self.task = None
         self.connected = False
         self.running = False
-        self.clients = []
-        self.clients_lock = asyncio.Lock()
+        self.subscribers = {}  # prompt_id -> client
+        self.executing_prompt_id = None
+        self.queue_remaining = 0
     
     async def start(self, loop):
         """Start the websocket subsystem"""
@@ -32,41 +35,73 @@ class WebSocketSubsystem:
         
         self.running = False
         self.connected = False
+        self.executing_prompt_id = None
         
         if self.task:
             self.task.cancel()
             logger.info("WebSocket subsystem stopped")
     
     async def add_client(self, client):
-        """Add a client to receive messages"""
-        async with self.clients_lock:
-            self.clients.append(client)
+        """Subscribe a client to messages for its prompt_id"""
+        self.subscribers[client.prompt_id] = client
     
     async def remove_client(self, client):
         """Remove a client"""
-        async with self.clients_lock:
-            if client in self.clients:
-                self.clients.remove(client)
+        if self.subscribers.get(client.prompt_id) is client:
+            del self.subscribers[client.prompt_id]
     
     async def _notify_clients(self, message):
-        """Send message to all clients"""
-        async with self.clients_lock:
-            for client in self.clients:
-                try:
-                    await client.on_message(message)
-                except Exception as e:
-                    logger.error(f"Client notification error: {e}")
+        """Route a message to the client that owns its prompt"""
+        if isinstance(message, bytes):
+            # Binary frames are previews for whatever prompt is executing.
+            client = self.subscribers.get(self.executing_prompt_id)
+            if client:
+                await self._deliver(client, message)
+            return
+
+        try:
+            message = json.loads(message)
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse websocket message: {e}")
+            return
+
+        message_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id", self.executing_prompt_id)
+
+        if message_type == "status":
+            exec_info = data.get("status", {}).get("exec_info", {})
+            self.queue_remaining = exec_info.get("queue_remaining", self.queue_remaining)
+            return
+
+        if message_type == "execution_start":
+            self.executing_prompt_id = prompt_id
+        elif message_type == "executing" and data.get("node") is None and prompt_id == self.executing_prompt_id:
+            self.executing_prompt_id = None
+        elif message_type in ("execution_error", "execution_interrupted") and prompt_id == self.executing_prompt_id:
+            self.executing_prompt_id = None
+
+        client = self.subscribers.get(prompt_id)
+        if client:
+            await self._deliver(client, message)
+
+    async def _deliver(self, client, message):
+        try:
+            await client.on_message(message)
+        except Exception as e:
+            logger.error(f"Client notification error: {e}")
     
     async def _run(self):
         """Main websocket connection loop"""
-        uri = f"ws://{server_ip}/ws?clientId={client_id}"
+        uri = f"ws://{self.address}/ws?clientId={client_id}"
         retry_delay = 5
         
         while self.running:
             try:
                 async with websockets.connect(uri, ping_interval=30, ping_timeout=10) as ws:
                     self.connected = True
-                    logger.info("WebSocket connected")
+                    self.executing_prompt_id = None
+                    logger.info(f"WebSocket connected to {self.address}")
                     
                     while self.running and self.connected:
                         try:
@@ -82,35 +117,9 @@ class WebSocketSubsystem:
                 break
             except Exception as e:
                 self.connected = False
+                self.executing_prompt_id = None
                 if self.running:
                     await asyncio.sleep(retry_delay)
                     retry_delay = min(retry_delay * 2, 60)
         
         self.connected = False
-
-
-# Global instance
-_subsystem = WebSocketSubsystem()
-
-# Simple interface
-def start_websocket(loop):
-    """Start the websocket subsystem"""
-    asyncio.create_task(_subsystem.start(loop))
-
-def stop_websocket():
-    """Stop the websocket subsystem"""
-    _subsystem.stop()
-
-def is_websocket_connected():
-    """Check if websocket is connected"""
-    return _subsystem.connected
-
-
-# Client management functions for backward compatibility
-async def add_client(client):
-    """Add a client to receive websocket messages (backward compatibility)"""
-    await _subsystem.add_client(client)
-
-async def remove_client(client):
-    """Remove a client from receiving websocket messages (backward compatibility)"""
-    await _subsystem.remove_client(client)
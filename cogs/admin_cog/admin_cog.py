@@ -1,6 +1,8 @@
 from discord.ext import commands
 import discord
 from utils.logging_config import get_logger
+from api.backend_pool import backend_pool
+from api.job_scheduler import job_scheduler
 
 logger = get_logger(__name__)
 
@@ -168,8 +170,15 @@ class AdminCog(commands.Cog, name="Admin", description="Admin commands for manag
         embed.add_field(name="Extensions", value=len(self.bot.extensions), inline=True)
         
         # Websocket status
-        websocket_status = "🟢 Connected" if hasattr(self.bot, 'websocket_started') and self.bot.websocket_started else "🔴 Disconnected"
+        websocket_status = "🟢 Connected" if backend_pool.is_available() else "🔴 Disconnected"
         embed.add_field(name="Websocket", value=websocket_status, inline=True)
+
+        # Backend status
+        backend_lines = []
+        for backend in backend_pool.backends:
+            status = "🟢" if backend.available else "🔴"
+            backend_lines.append(f"{status} `{backend.address}` load {backend.load} ({backend.running_jobs} running)")
+        embed.add_field(name="Backends", value="\n".join(backend_lines) or "None configured", inline=False)
         
         await ctx.followup.send(embed=embed)
 
@@ -180,16 +189,8 @@ class AdminCog(commands.Cog, name="Admin", description="Admin commands for manag
         await ctx.response.defer()
         
         try:
-            from api.websocket_subsystem import stop_websocket, start_websocket
-            
-            # Stop existing websocket
-            if hasattr(self.bot, 'websocket_started') and self.bot.websocket_started:
-                stop_websocket()
-                self.bot.websocket_started = False
-            
-            # Start new websocket
-            start_websocket(self.bot.loop)
-            self.bot.websocket_started = True
+            # Reconnect every backend websocket
+            await backend_pool.restart_websockets()
             
             logger.info("Websocket connection restarted")
             await ctx.followup.send("✅ Websocket connection restarted successfully")
@@ -198,6 +199,54 @@ class AdminCog(commands.Cog, name="Admin", description="Admin commands for manag
             logger.error(f"Failed to restart websocket: {e}")
             await ctx.followup.send(f"❌ Failed to restart websocket: {str(e)}", ephemeral=True)
 
+    @admin.command(name="job_queue", description="Show the image job scheduler queue")
+    @commands.is_owner()
+    async def job_queue(self, ctx: discord.ApplicationContext):
+        """Show scheduler queue depth and waits for each priority lane"""
+        await ctx.response.defer()
+
+        stats = job_scheduler.stats()
+        embed = discord.Embed(
+            title="Job Queue",
+            description=f"Running: {stats['running']}/{stats['max_running']} - Default user cap: {stats['default_user_cap']}",
+            color=discord.Color.blue()
+        )
+        for lane_name, lane in stats["lanes"].items():
+            embed.add_field(
+                name=lane_name.title(),
+                value=f"Waiting: {lane['depth']}\n"
+                      f"Oldest wait: {lane['oldest_wait']:.1f}s\n"
+                      f"Average wait: {lane['average_wait']:.1f}s",
+                inline=True
+            )
+
+        await ctx.followup.send(embed=embed)
+
+    @admin.command(name="user_cap", description="Set how many image jobs a user can run at once")
+    @commands.is_owner()
+    @discord.option(
+        "cap",
+        description="Concurrent jobs allowed",
+        type=int,
+        min_value=1,
+        required=True
+    )
+    @discord.option(
+        "user",
+        description="User to change. Leave empty to change the default for everyone",
+        type=discord.User,
+        required=False,
+        default=None
+    )
+    async def user_cap(self, ctx: discord.ApplicationContext, cap: int, user: discord.User):
+        """Change a per-user concurrency cap at runtime"""
+        if user:
+            job_scheduler.set_user_cap(user.id, cap)
+            await ctx.respond(f"✅ {user.mention} can now run {cap} jobs at once")
+        else:
+            job_scheduler.set_default_user_cap(cap)
+            await ctx.respond(f"✅ Users can now run {cap} jobs at once")
+
     @commands.Cog.listener()
     async def on_ready(self):
         logger.info("AdminCog is ready")
@@ -7,7 +7,8 @@ from settings import (
     sdxl_loras,
 )
 from .comfy_options import draw_options, default_options
-from api.model_db import upsert_model_default, upsert_sd_default, init_model_db
+from api.model_db import upsert_model_default, upsert_sd_default, init_model_db, set_guild_preview_mode
+from models.preview_mode import PreviewMode
 from models.sd_options import SDType, SDOptions
 from cogs.view import ComfySDView, ComfySDXLView, FluxPromptModal, VideoPromptModal, EditPromptModal
 from dispatchers.dream_dispatcher import dream_dispatcher
@@ -243,6 +244,19 @@ class ComfyCog(commands.Cog, name="Stable Diffusion", description="Create images
         await upsert_model_default(model, prompt_template, negative_prompt, width, height, steps, cfg, sampler, scheduler, hires, hires_strength)
         await ctx.followup.send("Completed")
 
+    @discord.slash_command(name="previews", description="Set how progress previews are shown in this server")
+    @discord.guild_only()
+    @discord.default_permissions(administrator=True)
+    @discord.option(
+        "mode",
+        description="off hides previews, low sends small ones",
+        choices=[mode.value for mode in PreviewMode],
+        required=True
+    )
+    async def previews(self, ctx: discord.ApplicationContext, mode: str):
+        await set_guild_preview_mode(ctx.guild.id, PreviewMode(mode))
+        await ctx.respond(f"✅ Progress previews are now `{mode}` in this server")
+
     @commands.Cog.listener()
     async def on_ready(self):
         await init_model_db()
@@ -149,6 +149,7 @@ class TeaCog(commands.Cog, name="TeaCog", description="Responds to users and do
         if (
             message.author.bot
             or not message.content.strip()
+            or not self.message_queue.should_process_message(message)
         ):
             return
 
@@ -1,17 +1,28 @@
 import asyncio
+from contextlib import aclosing
 from discord import Message, Bot
 import discord
-from api.openai_api import send_message
+from api.openai_api import send_message, stream_message
 from api.tea_db import get_guild_autoreply, is_user_opt_out
 from actions.dream import dream
-from api.job_db import add_job
+from actions.base_job import JobTimeoutError, JobExecutionError
+from api.job_scheduler import Priority
+from api.job_db import add_job, link_message
+from api.artifact_store import artifact_store
 from models.sd_options import SDOptions, SDType
-from models.autoreply import GuildAutoReply
 from utils.message_utils import ProgressMessenger, format_image_message
+from utils.discord_outbound import discord_outbound
+from utils.image_utils import get_vision_image
 from cogs.view import ComfySDXLView
-from PIL import Image
-import base64
-import io
+from cogs.tea_cog.tea_cog_stream import TeaStreamReply
+from settings import (
+    openai_stream,
+    tea_max_concurrency,
+    tea_lane_queue_size,
+    tea_lane_idle_timeout,
+    tea_image_workers,
+    tea_image_queue_size,
+)
 from utils.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -20,84 +31,134 @@ MAX_LENGTH = 1500
 
 
 class TeaCogMessageQueue:
+    """Queues Tea messages in one lane per guild.
+
+    Messages in a lane are answered in order, while lanes run in parallel up
+    to a global limit. Lane workers exit after sitting idle for a while.
+    """
+
     def __init__(self, bot: Bot):
         self.bot = bot
-        self.message_queue: asyncio.Queue[Message] = asyncio.Queue()
-        self.image_queue: asyncio.Queue[tuple[str, Message]] = asyncio.Queue()
-        bot.loop.create_task(self._process_message_queue())
-        bot.loop.create_task(self._process_image_queue())
+        self.lanes: dict[int, asyncio.Queue[Message]] = {}
+        self.lane_workers: dict[int, asyncio.Task] = {}
+        self.concurrency = asyncio.Semaphore(tea_max_concurrency)
+        self.image_queue: asyncio.Queue[tuple[str, Message]] = asyncio.Queue(maxsize=tea_image_queue_size)
+        # Finished images waiting to be sent; bounded so generation cannot
+        # run far ahead of uploads.
+        self.upload_queue: asyncio.Queue = asyncio.Queue(maxsize=tea_image_workers)
+        self.pending_images: set[tuple[int, str]] = set()
+        for _ in range(tea_image_workers):
+            bot.loop.create_task(self._process_image_queue())
+        bot.loop.create_task(self._process_upload_queue())
 
-    async def queue_message(self, message: Message):
-        await self.message_queue.put(message)
+    async def queue_message(self, message: Message) -> bool:
+        """Queue a message in its guild's lane, returning False if the lane is full"""
+        lane_id = message.guild.id
+        lane = self.lanes.get(lane_id)
+        if lane is None:
+            lane = self.lanes[lane_id] = asyncio.Queue(maxsize=tea_lane_queue_size)
+            self.lane_workers[lane_id] = self.bot.loop.create_task(self._process_lane(lane_id, lane))
 
-    async def queue_image(self, prompt: str, message: Message):
-        await self.image_queue.put((prompt, message))
+        try:
+            lane.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning(f"Tea lane for guild {lane_id} is full, dropping message {message.id}")
+            return False
+        return True
 
-    async def _process_message_queue(self):
-        while True:
-            message = None
-            try:
-                message = await self.message_queue.get()
-                b64_image: str = None
-                for attachment in message.attachments:
-                    if "image" in attachment.content_type:
-                        b64_image = self._get_message_image(await attachment.read())
-                        break
-
-                guild_autoreply = await get_guild_autoreply(message.guild.id)
-                if await self._should_process_message(message, guild_autoreply):
-                    async with message.channel.typing():
-                        username = str(message.author.display_name)
-
-                        cleaned_message = self._remove_message_prefix(message.clean_content, guild_autoreply.prefix)
-                        formatted_message = f"{username}: {cleaned_message}"
-
-                        # Get response from AI.
-                        response = await send_message(
-                            message.guild.id,
-                            message.author.id,
-                            username,
-                            formatted_message,
-                            b64_image,
-                        )
-                        response = self._remove_username_prefix(response, "Tea")
-                        response = self._remove_everyone(response)
-
-                        # If AI requests for IMAGE generation handle it.
-                        parsed_response = response.split("IMAGE:")
-                        if len(parsed_response) > 1:
-                            prompt = parsed_response[1]
-                            await self.image_queue.put((prompt, message))
-
-                        # Send AI response to channel
-                        if parsed_response[0].strip():
-                            await self._send_response(
-                                message.channel,
-                                parsed_response[0]
-                            )
-            except asyncio.CancelledError:
-                # If we were cancelled, and we got a message, we need to mark it as done
-                if message is not None:
-                    self.message_queue.task_done()
-                # Re-raise the CancelledError to properly exit the coroutine
-                raise
-            except Exception as e:
-                logger.error(f"Error processing message: {e}")
-            finally:
-                # Only call task_done() if we actually got a message and weren't cancelled
-                # before getting the message
-                if message is not None and not asyncio.current_task().cancelled():
-                    try:
-                        self.message_queue.task_done()
-                    except ValueError:
-                        # task_done() was already called, ignore
-                        pass
+    def queue_image(self, prompt: str, message: Message) -> bool:
+        """Queue an image prompt, skipping it if the same prompt is already pending in the channel"""
+        key = self._image_key(prompt, message)
+        if key in self.pending_images:
+            logger.info(f"Coalesced duplicate image prompt in channel {message.channel.id}")
+            return False
+
+        try:
+            self.image_queue.put_nowait((prompt, message))
+        except asyncio.QueueFull:
+            logger.warning(f"Tea image queue is full, dropping prompt from message {message.id}")
+            return False
+        self.pending_images.add(key)
+        return True
+
+    async def _process_lane(self, lane_id: int, lane: asyncio.Queue[Message]):
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(lane.get(), tea_lane_idle_timeout)
+                except asyncio.TimeoutError:
+                    # Nothing can be queued between this check and removing the
+                    # lane, as queue_message does not yield in between.
+                    if lane.empty():
+                        return
+                    continue
+
+                try:
+                    async with self.concurrency:
+                        await self._process_message(message)
+                except Exception as e:
+                    logger.error(f"Error processing message: {e}")
+                finally:
+                    lane.task_done()
+        finally:
+            if self.lanes.get(lane_id) is lane:
+                del self.lanes[lane_id]
+                del self.lane_workers[lane_id]
+
+    async def _process_message(self, message: Message):
+        b64_image: str = None
+        for attachment in message.attachments:
+            if attachment.content_type and "image" in attachment.content_type:
+                b64_image = await get_vision_image(await attachment.read())
+                break
+
+        guild_autoreply = get_guild_autoreply(message.guild.id)
+        async with message.channel.typing():
+            username = str(message.author.display_name)
+
+            cleaned_message = message.clean_content
+            if guild_autoreply:
+                cleaned_message = self._remove_message_prefix(cleaned_message, guild_autoreply.prefix)
+            formatted_message = f"{username}: {cleaned_message}"
+
+            if openai_stream:
+                await self._stream_response(message, username, formatted_message, b64_image)
+                return
+
+            # Get response from AI.
+            response = await send_message(
+                message.guild.id,
+                message.author.id,
+                username,
+                formatted_message,
+                b64_image,
+            )
+            response = self._remove_username_prefix(response, "Tea")
+            response = self._remove_everyone(response)
+
+            # If AI requests for IMAGE generation handle it.
+            parsed_response = response.split("IMAGE:")
+            if len(parsed_response) > 1:
+                prompt = parsed_response[1]
+                self.queue_image(prompt, message)
+
+            # Send AI response to channel
+            if parsed_response[0].strip():
+                await self._send_response(
+                    message.channel,
+                    parsed_response[0]
+                )
+
+    def _image_key(self, prompt: str, message: Message):
+        return message.channel.id, " ".join(prompt.lower().split())
 
     async def _process_image_queue(self):
+        """Generate images and hand them to the upload worker"""
         while True:
-            prompt, message = None, None
+            prompt, message = await self.image_queue.get()
+            key = self._image_key(prompt, message)
+            uploading = False
             try:
-                prompt, message = await self.image_queue.get()
                 sd_options = await SDOptions.create(
                     sd_type=SDType.SDXL,
                     prompt=prompt,
@@ -121,46 +182,107 @@ class TeaCogMessageQueue:
                 job_id = add_job(sd_options)
                 image = await dream(
                     sd_options,
-                    progress_messenger.on_progress
+                    progress_messenger.on_progress,
+                    user_id=message.author.id,
+                    guild_id=message.guild.id,
+                    priority=Priority.BACKGROUND,
                 )
-                await progress_messenger.on_complete("Drawing Complete. Uploading now.")        
+                if image is None:
+                    logger.error(f"Image job {job_id} produced no image")
+                    await progress_messenger.delete_message()
+                    await self._send_image_error(message, "Unable to create image. No image was produced.")
+                    continue
+                # Uploading happens on its own worker so the next prompt can
+                # be submitted while this one is still sending.
+                await self.upload_queue.put((key, message, sd_options, job_id, image, progress_messenger))
+                uploading = True
+            except asyncio.CancelledError:
+                raise
+            except (JobTimeoutError, JobExecutionError) as e:
+                logger.error(f"Image job failed: {e}")
+                await self._send_image_error(message, f"Unable to create image. {e}.")
+            except Exception as e:
+                logger.error(f"Error processing image: {e}")
+                await self._send_image_error(message, "Unable to create image. Please see log for details")
+            finally:
+                if not uploading:
+                    self.pending_images.discard(key)
+                self.image_queue.task_done()
+
+    async def _process_upload_queue(self):
+        while True:
+            key, message, sd_options, job_id, image, progress_messenger = await self.upload_queue.get()
+            try:
+                await progress_messenger.on_complete("Drawing Complete. Uploading now.")
+                digest = await artifact_store.add_file(image)
                 image_file = discord.File(fp=image, filename="output.png")
-                await message.channel.send(
-                    format_image_message(message.author, sd_options, job_id),
-                    file=image_file, view=ComfySDXLView()
+                result = await discord_outbound.send_final(
+                    message.channel.id,
+                    lambda: message.channel.send(
+                        format_image_message(message.author, sd_options, job_id),
+                        file=image_file, view=ComfySDXLView()
+                    ),
                 )
+                link_message(result.id, "job", job_id)
+                await artifact_store.link_message(result.id, [(digest, "output.png")])
                 await progress_messenger.delete_message()
             except asyncio.CancelledError:
-                # If we were cancelled, and we got a message, we need to mark it as done
-                if prompt is not None and message is not None:
-                    self.image_queue.task_done()
-                # Re-raise the CancelledError to properly exit the coroutine
                 raise
             except Exception as e:
-                logger.error(f"Error processing image: {e}")
-                if message is not None:
-                    await message.channel.send("Unable to create image. Please see log for details")
+                logger.error(f"Error uploading image: {e}")
+                await self._send_image_error(message, "Unable to create image. Please see log for details")
             finally:
-                # Only call task_done() if we actually got a message and weren't cancelled
-                # before getting the message
-                if prompt is not None and message is not None and not asyncio.current_task().cancelled():
-                    try:
-                        self.image_queue.task_done()
-                    except ValueError:
-                        # task_done() was already called, ignore
-                        pass
-
-    async def _should_process_message(self, message: Message, guild_auto_reply: GuildAutoReply):
-        user_opted_out = await is_user_opt_out(message.author.name)
-
-        allowed_channel = message.channel.id == guild_auto_reply.channel_id
-        has_prefix = message.content.startswith(guild_auto_reply.prefix)
-        channel_message_allowed = allowed_channel and (has_prefix if guild_auto_reply.reverse_check else not has_prefix)
+                self.pending_images.discard(key)
+                self.upload_queue.task_done()
+                if image is not None:
+                    image.close()
+
+    async def _send_image_error(self, message: Message, content: str):
+        try:
+            await message.channel.send(content)
+        except Exception as e:
+            logger.error(f"Error reporting image failure: {e}")
+
+    async def _stream_response(self, message: Message, username: str, formatted_message: str, b64_image: str):
+        async def queue_image(prompt: str):
+            self.queue_image(prompt, message)
+
+        reply = TeaStreamReply(
+            message.channel,
+            MAX_LENGTH,
+            on_image=queue_image,
+            clean_start=lambda response: self._remove_username_prefix(response, "Tea"),
+            clean=self._remove_everyone,
+        )
+        deltas = stream_message(
+            message.guild.id,
+            message.author.id,
+            username,
+            formatted_message,
+            b64_image,
+        )
+        async with aclosing(deltas):
+            async for delta in deltas:
+                await reply.feed(delta)
+        await reply.finish()
+
+    def should_process_message(self, message: Message) -> bool:
+        """Check a message against the in-memory autoreply and opt-out index"""
+        if message.guild is None or is_user_opt_out(message.author.name):
+            return False
 
         was_mentioned = (
             self.bot.user.mentioned_in(message) and not message.mention_everyone
         )
-        return (channel_message_allowed or was_mentioned) and not user_opted_out
+        if was_mentioned:
+            return True
+
+        guild_auto_reply = get_guild_autoreply(message.guild.id)
+        if guild_auto_reply is None or message.channel.id != guild_auto_reply.channel_id:
+            return False
+
+        has_prefix = message.content.startswith(guild_auto_reply.prefix)
+        return has_prefix if guild_auto_reply.reverse_check else not has_prefix
 
     def _remove_username_prefix(self, response: str, username: str) -> str:
         username_lower = username.lower()
@@ -183,33 +305,3 @@ class TeaCogMessageQueue:
                 await channel.send(response[i : i + MAX_LENGTH])
         else:
             await channel.send(response)
-
-    def _get_message_image(self, image: bytes) -> str:
-        # Download the image
-        if not image:
-            return None
-
-        with io.BytesIO(image) as image_io:
-            image = Image.open(image_io)
-            if image.size[0] > 768 or image.size[1] > 2000:
-                image.thumbnail((768, 2000))
-            if image.mode in ("RGBA", "P"):
-                image = image.convert("RGB")
-
-            compressed_io = io.BytesIO()
-            for quality in range(100, 0, -5):
-                compressed_io.seek(0)
-                image.save(compressed_io, format="JPEG", quality=quality, optimize=True)
-                size = compressed_io.tell()
-                if size < 20 * 1024 * 1024:
-                    break
-
-            if size >= 20 * 1024 * 1024:
-                return None
-
-            compressed_io.seek(0)
-            image_base64 = base64.b64encode(compressed_io.getvalue())
-
-            image = Image.open(compressed_io)
-
-            return image_base64.decode("utf-8")
@@ -0,0 +1,130 @@
+from typing import Awaitable, Callable
+from discord.abc import Messageable
+from utils.discord_outbound import discord_outbound
+
+IMAGE_MARKER = "IMAGE:"
+# Text that is rewritten before display, so a partial match at the end of
+# the stream is held back until the next piece arrives.
+HELD_MARKERS = (IMAGE_MARKER, "@everyone")
+
+
+def _held_suffix_length(text: str) -> int:
+    """Length of the longest suffix of text that could start a held marker"""
+    longest = 0
+    for marker in HELD_MARKERS:
+        for length in range(min(len(marker) - 1, len(text)), longest, -1):
+            if text.endswith(marker[:length]):
+                longest = length
+                break
+    return longest
+
+
+class TeaStreamReply:
+    """Shows a streamed Tea reply in a channel as it is generated.
+
+    The first visible text is posted right away. Later edits go through the
+    outbound scheduler, which paces them with other progress edits in the
+    channel. Text past max_length rolls over into a new message.
+    Anything after an IMAGE: directive is hidden and its prompt handed to
+    on_image as soon as the prompt's line is complete.
+    """
+
+    def __init__(
+        self,
+        channel: Messageable,
+        max_length: int,
+        on_image: Callable[[str], Awaitable[None]],
+        clean_start: Callable[[str], str],
+        clean: Callable[[str], str],
+    ):
+        self.channel = channel
+        self.max_length = max_length
+        self.on_image = on_image
+        self.clean_start = clean_start
+        self.clean = clean
+        self.pending = ""  # streamed text not yet shown
+        self.text = ""  # text of the current Discord message
+        self.shown = ""  # what the current Discord message last displayed
+        self.message = None
+        self.started = False
+        self.image_prompt = None
+        self.image_routed = False
+
+    async def feed(self, delta: str):
+        if self.image_prompt is not None:
+            self.image_prompt += delta
+            await self._route_image(final=False)
+            return
+
+        self.pending += delta
+        if not self.started:
+            # Wait for enough text to strip a leading "Tea: ".
+            if len(self.pending) < len("Tea") + 2 and IMAGE_MARKER not in self.pending:
+                return
+            self.pending = self.clean_start(self.pending)
+            self.started = True
+
+        marker_index = self.pending.find(IMAGE_MARKER)
+        if marker_index != -1:
+            visible = self.pending[:marker_index]
+            self.image_prompt = self.pending[marker_index + len(IMAGE_MARKER):]
+            self.pending = ""
+            await self._append(visible)
+            await self._route_image(final=False)
+            return
+
+        release = len(self.pending) - _held_suffix_length(self.pending)
+        visible, self.pending = self.pending[:release], self.pending[release:]
+        await self._append(visible)
+
+    async def finish(self):
+        """Flush the rest of the reply once the stream has ended"""
+        if not self.started:
+            self.pending = self.clean_start(self.pending)
+            self.started = True
+        visible, self.pending = self.pending, ""
+        await self._append(visible, force=True)
+        await self._route_image(final=True)
+
+    async def _append(self, visible: str, force: bool = False):
+        self.text += self.clean(visible)
+        while len(self.text) > self.max_length:
+            await self._show(self.text[: self.max_length], force=True)
+            self.message = None
+            self.shown = ""
+            self.text = self.text[self.max_length:]
+        await self._show(self.text, force=force)
+
+    async def _show(self, content: str, force: bool):
+        if not content.strip() or content == self.shown:
+            return
+
+        if self.message is None:
+            self.message = await discord_outbound.send_final(self.channel.id, lambda: self.channel.send(content))
+            self.shown = content
+        elif force:
+            # Replaces any edit still waiting, so the message ends with this text.
+            await discord_outbound.cancel_progress(self)
+            message = self.message
+            await discord_outbound.send_final(self.channel.id, lambda: message.edit(content=content))
+            self.shown = content
+        else:
+            message = self.message
+            discord_outbound.submit_progress(self, self.channel.id, lambda: self._edit(message, content))
+
+    async def _edit(self, message, content: str):
+        await message.edit(content=content)
+        if message is self.message:
+            self.shown = content
+
+    async def _route_image(self, final: bool):
+        if self.image_routed or self.image_prompt is None:
+            return
+
+        prompt = self.image_prompt.lstrip()
+        if "\n" in prompt:
+            prompt = prompt.split("\n", 1)[0]
+        elif not final:
+            return
+        self.image_routed = True
+        await self.on_image(prompt)
@@ -1,5 +1,15 @@
 import discord
-from api.job_db import get_job, add_fluxjob, get_fluxjob, add_videojob, get_videojob, add_editjob, get_editjob
+from api.job_db import (
+    get_job,
+    add_fluxjob,
+    get_fluxjob,
+    add_videojob,
+    get_videojob,
+    add_editjob,
+    get_editjob,
+    link_message,
+    get_message_job,
+)
 from dispatchers.dream_dispatcher import dream_dispatcher
 from dispatchers.upscale_dispatcher import upscale_dispatcher
 from settings import sdxl_select_models, sd_select_models
@@ -12,10 +22,24 @@ from io import BytesIO
 from utils.logging_config import get_logger
 from utils.error_utils import handle_interaction_error
 from actions.base_job import ReplicateJob
+from api.artifact_store import artifact_store
 
 logger = get_logger(__name__)
 
 
+# Job IDs printed in result messages, only needed for messages posted
+# before results were linked to their jobs.
+JOB_ID_PATTERN = re.compile(r"Job ID ``(\d+)``", re.IGNORECASE)
+
+
+async def get_message_job_id(message: discord.Message, kind: str) -> int:
+    """ID of the job a result message was posted for"""
+    link = await get_message_job(message.id)
+    if link is not None and link[0] == kind:
+        return link[1]
+    return int(JOB_ID_PATTERN.findall(message.content)[-1])
+
+
 class BaseView(discord.ui.View):
     """Base view class with error handling for all UI interactions"""
 
@@ -223,11 +247,15 @@ class FluxPromptModal(BaseModal):
         job_id = add_fluxjob(prompt)
         await followup.delete()
         files = []
+        artifacts = []
         for idx, output_file in enumerate(output_files):
+            data = await output_file.aread()
+            filename = f"output-{idx}.png"
+            artifacts.append((await artifact_store.add_bytes(data), filename))
             files.append(
                 discord.File(
-                    fp=io.BytesIO(await output_file.aread()),
-                    filename=f"output-{idx}.png")
+                    fp=io.BytesIO(data),
+                    filename=filename)
                 )
         message_lines = [
             f"{interaction.user.mention} here is your image!",
@@ -237,11 +265,13 @@ class FluxPromptModal(BaseModal):
             f"Job ID ``{job_id}``"
         ]
 
-        await interaction.channel.send(
+        message = await interaction.channel.send(
             "\n".join(message_lines),
             files=files,
             view=FluxView()
         )
+        link_message(message.id, "fluxjob", job_id)
+        await artifact_store.link_message(message.id, artifacts)
 
 class VideoPromptModal(BaseModal):
     def __init__(self, prompt, image: discord.Attachment, resolution: str, orientation: str) -> None:
@@ -303,10 +333,12 @@ class VideoPromptModal(BaseModal):
         output_file = await job.run()
 
         await followup.delete()
+        data = await output_file.aread()
+        artifacts = [(await artifact_store.add_bytes(data), "output.mp4")]
         files = []
         files.append(
             discord.File(
-                fp=io.BytesIO(await output_file.aread()),
+                fp=io.BytesIO(data),
                 filename=f"output.mp4")
             )
 
@@ -318,11 +350,13 @@ class VideoPromptModal(BaseModal):
             f"Job ID ``{job_id}``"
         ]
 
-        await interaction.channel.send(
+        message = await interaction.channel.send(
             "\n".join(message_lines),
             files=files,
             view=VideoView()
         )
+        link_message(message.id, "videojob", job_id)
+        await artifact_store.link_message(message.id, artifacts)
 
 class EditPromptModal(BaseModal):
     def __init__(self, image: discord.Attachment) -> None:
@@ -369,10 +403,12 @@ class EditPromptModal(BaseModal):
         logger.info(output_file.url)
 
         await followup.delete()
+        data = await output_file.aread()
+        artifacts = [(await artifact_store.add_bytes(data), "edited-output.png")]
         files = []
         files.append(
             discord.File(
-                fp=io.BytesIO(await output_file.aread()),
+                fp=io.BytesIO(data),
                 filename=f"edited-output.png")
             )
 
@@ -384,11 +420,13 @@ class EditPromptModal(BaseModal):
             f"Job ID ``{job_id}``"
         ]
 
-        await interaction.channel.send(
+        message = await interaction.channel.send(
             "\n".join(message_lines),
             files=files,
             view=EditView()
         )
+        link_message(message.id, "editjob", job_id)
+        await artifact_store.link_message(message.id, artifacts)
 
 
 # Select dropdown for models.
@@ -403,12 +441,8 @@ class ModelSelect(discord.ui.Select):
 
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        job_id_search = re.findall(
-            "Job ID ``(\d+)``", interaction.message.content, re.IGNORECASE
-        )
-        job_id = job_id_search[-1]
-
-        sd_options = get_job(job_id)
+        job_id = await get_message_job_id(interaction.message, "job")
+        sd_options = await get_job(job_id)
         sd_options.model = self.values[0]
         await dream_dispatcher(sd_options, interaction.followup, interaction.channel, interaction.user, self.parent_view)
 
@@ -418,12 +452,8 @@ class EditButton(discord.ui.Button):
         self.parent_view = parent_view
 
     async def callback(self, interaction: discord.Interaction):
-        job_id_search = re.findall(
-            "Job ID ``(\d+)``", interaction.message.content, re.IGNORECASE
-        )
-        job_id = job_id_search[-1]
-
-        sd_options = get_job(job_id)
+        job_id = await get_message_job_id(interaction.message, "job")
+        sd_options = await get_job(job_id)
         await interaction.response.send_modal(EditModal(sd_options, self.parent_view))
 
 class VideoButton(discord.ui.Button):
@@ -432,8 +462,9 @@ class VideoButton(discord.ui.Button):
         self.parent_view = parent_view
 
     async def callback(self, interaction: discord.Interaction):
+        attachments = await artifact_store.get_attachments(interaction.message)
         await interaction.response.send_modal(
-            VideoPromptModal("", interaction.message.attachments[0], "480p", None)
+            VideoPromptModal("", attachments[0], "480p", None)
         )
 
 class FluxEditButton(discord.ui.Button):
@@ -442,12 +473,8 @@ class FluxEditButton(discord.ui.Button):
         self.parent_view = parent_view
 
     async def callback(self, interaction: discord.Interaction):
-        job_id_search = re.findall(
-            "Job ID ``(\d+)``", interaction.message.content, re.IGNORECASE
-        )
-        job_id = job_id_search[-1]
-
-        prompt = get_fluxjob(job_id)
+        job_id = await get_message_job_id(interaction.message, "fluxjob")
+        prompt = await get_fluxjob(job_id)
         await interaction.response.send_modal(FluxPromptModal(prompt))
 
 class VideoEditButton(discord.ui.Button):
@@ -456,12 +483,8 @@ class VideoEditButton(discord.ui.Button):
         self.parent_view = parent_view
 
     async def callback(self, interaction: discord.Interaction):
-        job_id_search = re.findall(
-            "Job ID ``(\d+)``", interaction.message.content, re.IGNORECASE
-        )
-        job_id = job_id_search[-1]
-
-        prompt = get_videojob(job_id)
+        job_id = await get_message_job_id(interaction.message, "videojob")
+        prompt = await get_videojob(job_id)
         await interaction.response.send_modal(VideoPromptModal(prompt))
 
 class EditImageButton(discord.ui.Button):
@@ -470,8 +493,9 @@ class EditImageButton(discord.ui.Button):
         self.parent_view = parent_view
 
     async def callback(self, interaction: discord.Interaction):
+        attachments = await artifact_store.get_attachments(interaction.message)
         await interaction.response.send_modal(
-            EditPromptModal(interaction.message.attachments[0])
+            EditPromptModal(attachments[0])
         )
 
 class RedrawButton(discord.ui.Button):
@@ -481,12 +505,8 @@ class RedrawButton(discord.ui.Button):
 
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        job_id_search = re.findall(
-            "Job ID ``(\d+)``", interaction.message.content, re.IGNORECASE
-        )
-        job_id = job_id_search[-1]
-
-        sd_options = get_job(job_id)
+        job_id = await get_message_job_id(interaction.message, "job")
+        sd_options = await get_job(job_id)
         sd_options.seed = random.randint(1, 4294967294)
         await dream_dispatcher(sd_options, interaction.followup, interaction.channel, interaction.user, self.parent_view)
 
@@ -502,7 +522,7 @@ class SpoilerButton(discord.ui.Button):
         message = interaction.message.content
 
         files = []
-        for attachment in interaction.message.attachments:
+        for attachment in await artifact_store.get_attachments(interaction.message):
             file = await attachment.read()
             files.append(
                 discord.File(fp=io.BytesIO(file), filename="output.png", spoiler=True)
@@ -553,7 +573,7 @@ class UpscaleButton(discord.ui.Button):
 
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        attachments = interaction.message.attachments
+        attachments = await artifact_store.get_attachments(interaction.message)
         if len(attachments) != 1:
             await interaction.followup.send("Unable to upscale image.")
             return
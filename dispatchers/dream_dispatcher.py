@@ -1,21 +1,42 @@
 import discord
 from actions.dream import dream
+from actions.base_job import JobTimeoutError, JobExecutionError
 from models.sd_options import SDOptions
+from models.lora_catalog import InvalidLoraError
 from utils.message_utils import ProgressMessenger, format_image_message
-from api.job_db import add_job
+from api.job_db import add_job, link_message
+from api.artifact_store import artifact_store
+from utils.discord_outbound import discord_outbound
 
 async def dream_dispatcher(sd_options: SDOptions, followup, channel, user, view):
     progress_messenger = ProgressMessenger(channel)
+    # DM and partial channels have no guild attribute.
+    guild = getattr(channel, "guild", None)
     job_id = add_job(sd_options)
 
     if followup:
         await followup.send("Request queued. Please Wait.", delete_after=10)
     
-    image = await dream(sd_options, progress_messenger.on_progress)
+    try:
+        image = await dream(
+            sd_options,
+            progress_messenger.on_progress,
+            user_id=user.id,
+            guild_id=guild.id if guild else None,
+        )
+    except (JobTimeoutError, JobExecutionError) as e:
+        await progress_messenger.on_complete(f"{user.mention} ❌ {e}. Please try again.")
+        return
+    except InvalidLoraError as e:
+        await progress_messenger.on_complete(f"{user.mention} ❌ {e}.")
+        return
     await progress_messenger.on_complete("Drawing Complete. Uploading now.") 
+    digest = await artifact_store.add_file(image)
     image_file = discord.File(fp=image, filename="output.png")
-    await channel.send(
-        format_image_message(user, sd_options, job_id),
-        file=image_file, view=view
+    message = await discord_outbound.send_final(
+        channel.id,
+        lambda: channel.send(format_image_message(user, sd_options, job_id), file=image_file, view=view),
     )
+    link_message(message.id, "job", job_id)
+    await artifact_store.link_message(message.id, [(digest, "output.png")])
     await progress_messenger.delete_message()
\ No newline at end of file
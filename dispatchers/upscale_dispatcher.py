@@ -1,18 +1,34 @@
 import discord
 from actions.upscale import upscale
+from actions.base_job import JobTimeoutError, JobExecutionError
 from utils.message_utils import ProgressMessenger
+from api.artifact_store import artifact_store
+from utils.discord_outbound import discord_outbound
 
 async def upscale_dispatcher(image, followup, channel, user, view):
     progress_messenger = ProgressMessenger(channel)
+    # DM and partial channels have no guild attribute.
+    guild = getattr(channel, "guild", None)
 
     if followup:
         await followup.send("Request queued. Please Wait.", delete_after=10)
     
-    image = await upscale(image, progress_messenger.on_progress)
+    try:
+        image = await upscale(
+            image,
+            progress_messenger.on_progress,
+            user_id=user.id,
+            guild_id=guild.id if guild else None,
+        )
+    except (JobTimeoutError, JobExecutionError) as e:
+        await progress_messenger.on_complete(f"{user.mention} ❌ {e}. Please try again.")
+        return
     await progress_messenger.on_complete("Upscaling Complete. Uploading now.") 
+    digest = await artifact_store.add_file(image)
     image_file = discord.File(fp=image, filename="output.png")
-    await channel.send(
-        f"{user.mention} here is your upscaled image!",
-        file=image_file, view=view
+    message = await discord_outbound.send_final(
+        channel.id,
+        lambda: channel.send(f"{user.mention} here is your upscaled image!", file=image_file, view=view),
     )
+    await artifact_store.link_message(message.id, [(digest, "output.png")])
     await progress_messenger.delete_message()
\ No newline at end of file
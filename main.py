@@ -2,9 +2,13 @@ import discord
 import asyncio
 
 from settings import bot_token, set_comfy_settings
-from api.comfy_api import get_system_info
-from api.websocket_subsystem import start_websocket, stop_websocket
-from api.job_db import init_db
+from api.backend_pool import backend_pool
+from api.job_db import init_db, close_db
+from api.artifact_store import init_artifact_store, close_artifact_store
+from api.model_db import close_model_db
+from api.tea_db import close_tea_db
+from api.chat_history_db import close_chat_db
+from utils.image_utils import shutdown_image_pool
 from api.job_tracker import job_tracker
 from cogs.view import ComfySDView, ComfySDXLView, UpscaleView, FluxView, EditView, VideoView
 from utils.logging_config import setup_logging, get_logger, set_bot_for_alerts
@@ -59,7 +63,8 @@ class ComfyUIBot(discord.Bot):
         set_bot_for_alerts(self)
         logger.info("Discord alert system initialized")
 
-        init_db()
+        await init_db()
+        await init_artifact_store()
 
         self.add_view(ComfySDView())
         self.add_view(ComfySDXLView())
@@ -69,9 +74,15 @@ class ComfyUIBot(discord.Bot):
         self.add_view(VideoView())
         logger.info("Persistent views added")
         
+        # Start backend clients, websockets and health checks after bot is fully ready
+        if not self.websocket_started:
+            await backend_pool.start()
+            self.websocket_started = True
+            logger.info("Backend pool started in on_ready")
+
         try:
             logger.info("Fetching ComfyUI system info...")
-            system_info = await get_system_info()
+            system_info = await backend_pool.get_system_info()
             logger.info(f"System info retrieved with keys: {list(system_info.keys())}")
             await set_comfy_settings(system_info)
             logger.info("ComfyUI settings loaded successfully")
@@ -80,12 +91,6 @@ class ComfyUIBot(discord.Bot):
             logger.error(f"Failed to load ComfyUI settings: {e}")
             logger.warning("Bot will continue without ComfyUI integration")
             self._system_info_loaded = True
-        
-        # Start websocket connection after bot is fully ready
-        if not self.websocket_started:
-            start_websocket(self.loop)
-            self.websocket_started = True
-            logger.info("Websocket subsystem started in on_ready")
 
     async def close(self):
         """Clean shutdown"""
@@ -98,7 +103,14 @@ class ComfyUIBot(discord.Bot):
             )
 
         if self.websocket_started:
-            stop_websocket()
+            await backend_pool.stop()
+            self.websocket_started = False
+        await close_db()
+        await close_artifact_store()
+        await close_model_db()
+        await close_tea_db()
+        await close_chat_db()
+        shutdown_image_pool()
         await super().close()
 
 async def main():
@@ -0,0 +1,73 @@
+import re
+
+LORA_PATTERN = re.compile(r"lora:([^\s:]+):(\d+\.?\d*)")
+
+
+class InvalidLoraError(ValueError):
+    """Raised when a prompt uses a LoRA made for a different model family"""
+
+    def __init__(self, name, sd_type):
+        super().__init__(f"LoRA {name} can not be used with {sd_type.upper()} models")
+        self.name = name
+        self.sd_type = sd_type
+
+
+class LoraCatalog:
+    """LoRAs available on the ComfyUI server, indexed per model family.
+
+    Each family maps both the display name and the file value to the file
+    value, so prompts may use either.
+    """
+
+    def __init__(self):
+        self.families = {}
+
+    def load(self, families):
+        """Rebuild the catalog from LoRAs already sorted into families.
+
+        families maps an SDType value to (display name, file value) pairs.
+        """
+        self.families = {
+            sd_type: {
+                **{display_name: value for display_name, value in loras},
+                **{value: value for _, value in loras},
+            }
+            for sd_type, loras in families.items()
+        }
+
+    def resolve(self, name, sd_type=None):
+        """File value for a LoRA, or None if the server does not have it.
+
+        Raises InvalidLoraError if the LoRA only exists for another family.
+        """
+        if sd_type is None:
+            for family in self.families.values():
+                if name in family:
+                    return family[name]
+            return None
+
+        value = self.families.get(sd_type, {}).get(name)
+        if value is None and any(name in family for family in self.families.values()):
+            raise InvalidLoraError(name, sd_type)
+        return value
+
+    def parse_prompt(self, prompt, sd_type=None):
+        """Split lora:name:strength tags out of a prompt.
+
+        Returns the cleaned prompt and the LoRAs the server knows, as
+        {"name", "strength"} dicts in prompt order.
+        """
+        loras = []
+
+        def take_lora(match):
+            value = self.resolve(match.group(1), sd_type)
+            if value is not None:
+                loras.append({"name": value, "strength": match.group(2)})
+            return ""
+
+        clean_prompt = LORA_PATTERN.sub(take_lora, prompt)
+        return clean_prompt.strip(), loras
+
+
+# Global instance
+lora_catalog = LoraCatalog()
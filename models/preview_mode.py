@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class PreviewMode(Enum):
+    OFF = 'off'
+    LOW = 'low'
+    NORMAL = 'normal'
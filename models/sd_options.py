@@ -1,6 +1,6 @@
 from enum import Enum
 import random
-from api.model_db import get_model_default, get_sd_default
+from api.model_db import get_merged_defaults
 import json
 from utils.logging_config import get_logger
 
@@ -76,16 +76,11 @@ class SDOptions:
 
     async def set_defaults(self):
         logger.debug(f"Setting defaults for model: {self.model}")
-        sd_default = await get_sd_default(self.sd_type.value)
-        model_default = await get_model_default(self.model or sd_default.get("model"))
-        logger.debug(f"SD defaults: {sd_default}")
-        logger.debug(f"Model defaults: {model_default}")
+        defaults = await get_merged_defaults(self.sd_type.value, self.model)
+        logger.debug(f"Merged defaults: {defaults}")
         for param in self.__dict__:
             if getattr(self, param) is None:
-                if model_default.get(param) is None:    
-                    setattr(self, param, sd_default.get(param))
-                else:
-                    setattr(self, param, model_default.get(param))
+                setattr(self, param, defaults.get(param))
 
     def merge_loras_into_prompt(self):
         loras = [self.lora, self.lora_two, self.lora_three]
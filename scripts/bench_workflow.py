@@ -0,0 +1,78 @@
+"""Compare rendering workflow templates with building compiled workflows.
+
+Run from the repository root:
+
+    python scripts/bench_workflow.py [--number N]
+
+Each case renders its template with Jinja and parses the JSON, then builds
+the same workflow with build_workflow, checks that both give the same
+graph, and prints the time per call for each path.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions.workflow import build_workflow
+from settings import templateEnv, sd_template, sdxl_template
+
+
+def draw_options(hires=None, loras=()):
+    options = {
+        "prompt": "a lighthouse on a cliff at sunset, highly detailed",
+        "negative_prompt": "blurry, low quality",
+        "cfg": 7.0,
+        "sampler": "euler_ancestral",
+        "scheduler": "normal",
+        "steps": 30,
+        "model": "model.safetensors",
+        "width": 1024,
+        "height": 1024,
+        "hires": hires,
+        "hires_strength": 0.5,
+        "seed": 123456789,
+        "loras": [{"name": name, "strength": "0.8"} for name in loras],
+    }
+    if hires:
+        options["hires_width"] = options["width"]
+        options["hires_height"] = options["height"]
+        options["width"] = options["width"] // 2
+        options["height"] = options["height"] // 2
+    return options
+
+
+CASES = [
+    ("sd", sd_template, draw_options()),
+    ("sd hires + 2 loras", sd_template, draw_options("4x-UltraSharp.pth", ["a", "b"])),
+    ("sdxl", sdxl_template, draw_options()),
+    ("sdxl hires + 2 loras", sdxl_template, draw_options("4x-UltraSharp.pth", ["a", "b"])),
+    ("upscale", "upscale.j2", {"image": "0" * 64 + ".png"}),
+]
+
+
+def render(template_name, options):
+    return json.loads(templateEnv.get_template(template_name).render(**options))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000, help="calls timed per path")
+    args = parser.parse_args()
+
+    print(f"{'case':<24}{'render + json.loads':>22}{'build_workflow':>18}{'speedup':>10}")
+    for name, template_name, options in CASES:
+        if render(template_name, options) != build_workflow(template_name, **options):
+            raise SystemExit(f"{name}: compiled workflow differs from the rendered one")
+
+        rendered = min(timeit.repeat(lambda: render(template_name, options), number=args.number, repeat=3))
+        built = min(timeit.repeat(lambda: build_workflow(template_name, **options), number=args.number, repeat=3))
+        rendered_us = rendered / args.number * 1e6
+        built_us = built / args.number * 1e6
+        print(f"{name:<24}{rendered_us:>20.1f}us{built_us:>16.1f}us{rendered_us / built_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
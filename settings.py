@@ -2,6 +2,7 @@ from typing import List
 from discord import OptionChoice, SelectOption
 from dotenv import load_dotenv
 import jinja2
+from models.lora_catalog import lora_catalog
 import os
 import uuid
 import logging
@@ -13,11 +14,73 @@ load_dotenv()
 admin_user_id = os.getenv("ADMIN_USER_ID")
 
 server_ip = os.getenv("COMFY_IP")
+# Comma separated list of ComfyUI hosts. Falls back to COMFY_IP.
+server_ips = [
+    ip.strip() for ip in (os.getenv("COMFY_IPS") or server_ip or "").split(",") if ip.strip()
+]
 client_id = str(uuid.uuid4())
+comfy_http_connection_limit = int(os.getenv("COMFY_HTTP_CONNECTION_LIMIT", "16"))
+comfy_http_keepalive = float(os.getenv("COMFY_HTTP_KEEPALIVE", "60"))
+# Total request timeouts in seconds for each ComfyUI endpoint.
+comfy_http_timeouts = {
+    "prompt": float(os.getenv("COMFY_PROMPT_TIMEOUT", "30")),
+    "history": float(os.getenv("COMFY_HISTORY_TIMEOUT", "30")),
+    "view": float(os.getenv("COMFY_VIEW_TIMEOUT", "120")),
+    "object_info": float(os.getenv("COMFY_OBJECT_INFO_TIMEOUT", "60")),
+    "queue": float(os.getenv("COMFY_QUEUE_TIMEOUT", "5")),
+    "upload": float(os.getenv("COMFY_UPLOAD_TIMEOUT", "120")),
+}
+comfy_health_interval = float(os.getenv("COMFY_HEALTH_INTERVAL", "10"))
+# Consecutive failed health checks before a backend is drained.
+comfy_unhealthy_threshold = int(os.getenv("COMFY_UNHEALTHY_THRESHOLD", "2"))
+
+# Bot side job scheduling. Jobs beyond these limits wait in the scheduler.
+scheduler_max_running = int(os.getenv("SCHEDULER_MAX_RUNNING", str(2 * max(len(server_ips), 1))))
+scheduler_user_cap = int(os.getenv("SCHEDULER_USER_CAP", "1"))
+# Jobs released from each priority lane per round when both lanes are waiting.
+scheduler_priority_weights = {
+    "INTERACTIVE": int(os.getenv("SCHEDULER_INTERACTIVE_WEIGHT", "4")),
+    "BACKGROUND": int(os.getenv("SCHEDULER_BACKGROUND_WEIGHT", "1")),
+}
+# Output downloads larger than this many bytes are spooled to disk.
+comfy_spool_max_size = int(os.getenv("COMFY_SPOOL_MAX_SIZE", str(8 * 1024 * 1024)))
+comfy_download_concurrency = int(os.getenv("COMFY_DOWNLOAD_CONCURRENCY", "4"))
+# Per-stage job deadlines in seconds. Set to 0 to wait forever.
+comfy_job_timeouts = {
+    "queued": float(os.getenv("COMFY_QUEUED_TIMEOUT", "900")),
+    "running": float(os.getenv("COMFY_RUNNING_TIMEOUT", "600")),
+    "fetching": float(os.getenv("COMFY_FETCHING_TIMEOUT", "120")),
+}
 bot_token = os.getenv("BOT_TOKEN")
 openai_api_key = os.getenv("OPENAI_API_KEY")
 openai_model = "gpt-4o-mini"
 openai_truncate_limit = 10500
+# Stream Tea replies into Discord as they are generated.
+openai_stream = os.getenv("OPENAI_STREAM", "true").lower() == "true"
+# Guilds answered at the same time, messages queued per guild, and seconds
+# before an idle guild's worker exits.
+tea_max_concurrency = int(os.getenv("TEA_MAX_CONCURRENCY", "4"))
+tea_lane_queue_size = int(os.getenv("TEA_LANE_QUEUE_SIZE", "20"))
+tea_lane_idle_timeout = float(os.getenv("TEA_LANE_IDLE_TIMEOUT", "60"))
+# Tea IMAGE: prompts generated at the same time, and prompts waiting.
+tea_image_workers = int(os.getenv("TEA_IMAGE_WORKERS", "2"))
+tea_image_queue_size = int(os.getenv("TEA_IMAGE_QUEUE_SIZE", "10"))
+# Pacing of progress message edits. Each message is edited at most once per
+# DISCORD_MESSAGE_INTERVAL seconds; each channel's interval adapts between
+# the min and max as Discord rate limits the bot.
+discord_message_interval = float(os.getenv("DISCORD_MESSAGE_INTERVAL", "1.0"))
+discord_channel_min_interval = float(os.getenv("DISCORD_CHANNEL_MIN_INTERVAL", "0.25"))
+discord_channel_max_interval = float(os.getenv("DISCORD_CHANNEL_MAX_INTERVAL", "5.0"))
+# Progress preview mode for servers that have not picked one: off, low or normal.
+preview_default_mode = os.getenv("PREVIEW_DEFAULT_MODE", "normal")
+# Finished workflows whose results are remembered, so exact repeats are not
+# generated again.
+job_result_cache_size = int(os.getenv("JOB_RESULT_CACHE_SIZE", "256"))
+# Generated outputs kept on local disk for follow-up actions.
+artifact_store_path = os.getenv("ARTIFACT_STORE_PATH", "artifacts")
+artifact_store_max_bytes = int(os.getenv("ARTIFACT_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Worker processes used to shrink and re-encode images for the vision model.
+image_process_workers = int(os.getenv("IMAGE_PROCESS_WORKERS", "2"))
 
 sd_models: List[OptionChoice] = []
 sdxl_models: List[OptionChoice] = []
@@ -114,6 +177,11 @@ async def set_comfy_settings(system_info):
                 )
             else:
                 logger.warning(f"Unknown lora type for {lora}")
+        # Keyed by SDType value.
+        lora_catalog.load({
+            "sd": [(lora.name, lora.value) for lora in sd_loras],
+            "sdxl": [(lora.name, lora.value) for lora in sdxl_loras],
+        })
 
         logger.info("Processing samplers and schedulers")
         system_samplers: List[str] = system_info["KSampler"]["input"]["required"]["sampler_name"][0]
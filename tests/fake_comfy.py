@@ -0,0 +1,58 @@
+import json
+from aiohttp import web, WSMsgType
+
+
+class FakeComfyServer:
+    """Minimal local ComfyUI server with the /queue and /ws endpoints.
+
+    queue_depth sets how many prompts /queue reports, and failing makes
+    /queue answer with a server error.
+    """
+
+    def __init__(self, queue_depth=0):
+        self.queue_depth = queue_depth
+        self.failing = False
+        self.queue_requests = 0
+        self.sockets = []
+        self.runner = None
+        self.port = None
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/queue", self.handle_queue)
+        app.router.add_get("/ws", self.handle_ws)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+
+    async def stop(self):
+        for ws in list(self.sockets):
+            await ws.close()
+        await self.runner.cleanup()
+
+    async def handle_queue(self, request):
+        self.queue_requests += 1
+        if self.failing:
+            raise web.HTTPInternalServerError()
+        return web.json_response({"queue_running": [], "queue_pending": [[i] for i in range(self.queue_depth)]})
+
+    async def handle_ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.append(ws)
+        await ws.send_str(
+            json.dumps({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": 0}}}})
+        )
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.sockets.remove(ws)
+        return ws
@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+from api import backend_pool as backend_pool_module
+from api.backend_pool import BackendPool, NoBackendAvailableError
+from tests.fake_comfy import FakeComfyServer
+
+
+class BackendPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.servers = [FakeComfyServer(queue_depth) for queue_depth in (3, 0, 1)]
+        for server in self.servers:
+            await server.start()
+        # Health checks are run by hand, so keep the background loop idle.
+        self.pool = BackendPool([server.address for server in self.servers], health_interval=3600)
+        await self.pool.start()
+        await self.wait_for(lambda: all(backend.websocket.connected for backend in self.pool.backends))
+
+    async def asyncTearDown(self):
+        await self.pool.stop()
+        for server in self.servers:
+            await server.stop()
+
+    async def wait_for(self, condition, timeout=5):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not condition():
+            if asyncio.get_running_loop().time() > deadline:
+                self.fail("condition not met in time")
+            await asyncio.sleep(0.01)
+
+    def backend_for(self, server):
+        return next(backend for backend in self.pool.backends if backend.address == server.address)
+
+    async def test_selects_least_loaded_backend(self):
+        self.assertEqual(self.pool.select().address, self.servers[1].address)
+
+        # Jobs this bot has in flight count even before /queue reports them.
+        self.backend_for(self.servers[1]).running_jobs = 2
+        self.assertEqual(self.pool.select().address, self.servers[2].address)
+
+        self.servers[2].queue_depth = 5
+        await self.pool.check_health()
+        self.assertEqual(self.pool.select().address, self.servers[1].address)
+
+    async def test_drains_after_unhealthy_threshold(self):
+        server = self.servers[1]
+        backend = self.backend_for(server)
+        server.failing = True
+
+        for _ in range(backend_pool_module.comfy_unhealthy_threshold - 1):
+            await self.pool.check_health()
+            self.assertTrue(backend.available)
+
+        await self.pool.check_health()
+        self.assertFalse(backend.available)
+        self.assertEqual(self.pool.select().address, self.servers[2].address)
+
+    async def test_readmits_recovered_backend(self):
+        server = self.servers[1]
+        backend = self.backend_for(server)
+        server.failing = True
+        for _ in range(backend_pool_module.comfy_unhealthy_threshold):
+            await self.pool.check_health()
+        self.assertFalse(backend.available)
+
+        server.failing = False
+        await self.pool.check_health()
+        self.assertTrue(backend.available)
+        self.assertEqual(backend.failures, 0)
+        self.assertEqual(self.pool.select().address, server.address)
+
+    async def test_no_backend_available(self):
+        for server in self.servers:
+            server.failing = True
+        for _ in range(backend_pool_module.comfy_unhealthy_threshold):
+            await self.pool.check_health()
+
+        self.assertFalse(self.pool.is_available())
+        with self.assertRaises(NoBackendAvailableError):
+            self.pool.select()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import asyncio
+import unittest
+from api.job_scheduler import JobScheduler, Priority
+
+
+class JobSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.scheduler = JobScheduler(max_running=1, user_cap=10, priority_weights={"INTERACTIVE": 1, "BACKGROUND": 1})
+        self.order = []
+        self.tasks = []
+
+    async def asyncTearDown(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def submit(self, user_id, guild_id=1, priority=Priority.INTERACTIVE):
+        async def job():
+            ticket = await self.scheduler.acquire(user_id, guild_id, priority)
+            self.order.append(user_id)
+            return ticket
+
+        task = asyncio.get_running_loop().create_task(job())
+        self.tasks.append(task)
+        await asyncio.sleep(0)
+        return task
+
+    async def run_all(self):
+        """Finish released jobs one at a time until nothing is waiting"""
+        while True:
+            await asyncio.sleep(0)
+            running = [task for task in self.tasks if task.done() and not getattr(task, "released", False)]
+            if not running:
+                return
+            for task in running:
+                task.released = True
+                self.scheduler.release(task.result())
+
+    async def test_users_in_a_guild_alternate(self):
+        for _ in range(4):
+            await self.submit("spammer")
+        # The first spammer job is already running when b arrives.
+        for _ in range(3):
+            await self.submit("b")
+
+        await self.run_all()
+        self.assertEqual(self.order, ["spammer", "b", "spammer", "b", "spammer", "b", "spammer"])
+
+    async def test_late_user_goes_before_last_served(self):
+        for _ in range(3):
+            await self.submit("spammer")
+        await self.submit("b")
+        await self.submit("c")
+
+        await self.run_all()
+        self.assertEqual(self.order, ["spammer", "b", "c", "spammer", "spammer"])
+
+    async def test_guilds_alternate(self):
+        for _ in range(3):
+            await self.submit("a", guild_id=1)
+        for _ in range(3):
+            await self.submit("b", guild_id=2)
+
+        await self.run_all()
+        self.assertEqual(self.order, ["a", "b", "a", "b", "a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+import discord
+from settings import (
+    discord_message_interval,
+    discord_channel_min_interval,
+    discord_channel_max_interval,
+)
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# An edit taking longer than this most likely waited out a rate limit inside
+# the Discord library, so it counts as a sign to back off.
+RATE_LIMITED_LATENCY = 1.0
+# Seconds taken off a channel's interval after each quick, successful edit.
+RECOVERY_STEP = 0.05
+
+
+class ChannelBucket:
+    """Pacing state for one channel.
+
+    The interval between progress edits grows multiplicatively when Discord
+    pushes back and shrinks additively while edits go through quickly.
+    """
+
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_allowed = 0.0
+        self.busy = False
+        self.finals = 0
+
+    def backoff(self, retry_after=None):
+        self.interval = min(self.max_interval, max(self.interval * 2, retry_after or 0))
+
+    def recover(self):
+        self.interval = max(self.min_interval, self.interval - RECOVERY_STEP)
+
+
+class ProgressUpdate:
+    def __init__(self, channel_id, send):
+        self.channel_id = channel_id
+        self.send = send
+
+
+class OutboundScheduler:
+    """Paces Discord progress edits across the whole bot.
+
+    Progress updates are keyed per message. A newer update replaces one that
+    has not been sent yet, so only the latest state goes out. Each channel
+    sends one progress edit at a time at its current interval, and each
+    message at most once per message_interval. Final results bypass the
+    queue and hold back progress edits in their channel until they are sent.
+    """
+
+    def __init__(self, message_interval=None, min_interval=None, max_interval=None):
+        self.message_interval = discord_message_interval if message_interval is None else message_interval
+        self.min_interval = discord_channel_min_interval if min_interval is None else min_interval
+        self.max_interval = discord_channel_max_interval if max_interval is None else max_interval
+        self.channels: dict[int, ChannelBucket] = {}
+        self.pending: dict[object, ProgressUpdate] = {}
+        self.in_flight: dict[object, asyncio.Task] = {}
+        self.message_next: dict[object, float] = {}
+        self.wakeup = None
+        self.worker = None
+
+    def _channel(self, channel_id) -> ChannelBucket:
+        bucket = self.channels.get(channel_id)
+        if bucket is None:
+            bucket = self.channels[channel_id] = ChannelBucket(self.min_interval, self.max_interval)
+        return bucket
+
+    def _wake(self):
+        if self.worker is None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+        self.wakeup.set()
+
+    def submit_progress(self, key, channel_id, send: Callable[[], Awaitable]):
+        """Queue a progress update, replacing any unsent one for the same key"""
+        self.pending[key] = ProgressUpdate(channel_id, send)
+        self._wake()
+
+    async def cancel_progress(self, key):
+        """Drop queued progress for a key and wait for one being sent to finish"""
+        self.pending.pop(key, None)
+        task = self.in_flight.get(key)
+        if task is not None:
+            await asyncio.shield(task)
+        self.message_next.pop(key, None)
+
+    async def send_final(self, channel_id, send: Callable[[], Awaitable]):
+        """Send something that must not wait behind progress edits"""
+        bucket = self._channel(channel_id)
+        bucket.finals += 1
+        try:
+            return await send()
+        finally:
+            bucket.finals -= 1
+            bucket.next_allowed = max(bucket.next_allowed, time.monotonic() + bucket.interval)
+            if self.wakeup is not None:
+                self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            next_due = None
+            # Forget message throttles that have run out.
+            for key in [key for key, due in self.message_next.items() if due <= now and key not in self.pending]:
+                del self.message_next[key]
+            for key, update in list(self.pending.items()):
+                bucket = self._channel(update.channel_id)
+                if bucket.busy or bucket.finals:
+                    continue
+                due = max(bucket.next_allowed, self.message_next.get(key, 0.0))
+                if due <= now:
+                    del self.pending[key]
+                    bucket.busy = True
+                    self.in_flight[key] = asyncio.get_running_loop().create_task(
+                        self._execute(key, update, bucket)
+                    )
+                elif next_due is None or due < next_due:
+                    next_due = due
+
+            # A timer rather than wait_for, which can swallow a cancellation
+            # that arrives as the event is set.
+            timer = None
+            if next_due is not None:
+                timer = asyncio.get_running_loop().call_later(next_due - now, self.wakeup.set)
+            try:
+                await self.wakeup.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    async def _execute(self, key, update: ProgressUpdate, bucket: ChannelBucket):
+        started = time.monotonic()
+        try:
+            await update.send()
+        except discord.HTTPException as e:
+            if e.status == 429:
+                bucket.backoff(getattr(e, "retry_after", None))
+            logger.warning(f"Progress update failed in channel {update.channel_id}: {e}")
+        except Exception as e:
+            logger.warning(f"Progress update failed in channel {update.channel_id}: {e}")
+        else:
+            if time.monotonic() - started > RATE_LIMITED_LATENCY:
+                bucket.backoff()
+            else:
+                bucket.recover()
+        finally:
+            finished = time.monotonic()
+            bucket.busy = False
+            bucket.next_allowed = finished + bucket.interval
+            self.message_next[key] = finished + self.message_interval
+            self.in_flight.pop(key, None)
+            self.wakeup.set()
+
+
+# Global instance
+discord_outbound = OutboundScheduler()
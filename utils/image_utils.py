@@ -0,0 +1,174 @@
+import asyncio
+import base64
+import hashlib
+import io
+import struct
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, features
+from models.preview_mode import PreviewMode
+from settings import image_process_workers
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Largest image the vision model accepts.
+MAX_VISION_IMAGE_BYTES = 20 * 1024 * 1024
+MAX_VISION_IMAGE_SIZE = (768, 2000)
+MIN_JPEG_QUALITY = 5
+MAX_JPEG_QUALITY = 100
+# Prepared images kept in memory, keyed by attachment hash.
+VISION_CACHE_SIZE = 32
+
+# ComfyUI binary websocket frames start with a big-endian event type.
+# Preview images follow it with an image type; previews with metadata follow
+# it with a JSON metadata block instead.
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+_FRAME_HEADER = struct.Struct(">I")
+# Longest side in pixels and encoder quality of progress previews per mode.
+PREVIEW_SIZES = {
+    PreviewMode.LOW: (256, 40),
+    PreviewMode.NORMAL: (512, 70),
+}
+MAX_PREVIEW_BYTES = 256 * 1024
+MIN_PREVIEW_QUALITY = 10
+# Frames whose perceptual hashes differ in fewer bits than this, and whose
+# mean brightness is this close, are treated as the same preview.
+PREVIEW_HASH_DISTANCE = 4
+PREVIEW_BRIGHTNESS_DISTANCE = 8
+PREVIEW_FORMAT, PREVIEW_EXTENSION = ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+
+_executor = None
+_vision_cache = OrderedDict()  # sha256 -> base64 JPEG or None
+
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def prepare_vision_image(data: bytes):
+    """Shrink an image and JPEG encode it at the best quality under the size limit.
+
+    Returns the base64 encoded JPEG, or None if even the lowest quality is
+    too large. Runs in a worker process.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if image.size[0] > MAX_VISION_IMAGE_SIZE[0] or image.size[1] > MAX_VISION_IMAGE_SIZE[1]:
+            image.thumbnail(MAX_VISION_IMAGE_SIZE)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        best = _encode_jpeg(image, MAX_JPEG_QUALITY)
+        if len(best) >= MAX_VISION_IMAGE_BYTES:
+            # Bisect for the highest quality that fits.
+            best = None
+            low, high = MIN_JPEG_QUALITY, MAX_JPEG_QUALITY - 1
+            while low <= high:
+                quality = (low + high) // 2
+                encoded = _encode_jpeg(image, quality)
+                if len(encoded) < MAX_VISION_IMAGE_BYTES:
+                    best = encoded
+                    low = quality + 1
+                else:
+                    high = quality - 1
+
+    if best is None:
+        return None
+    return base64.b64encode(best).decode("utf-8")
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=image_process_workers)
+    return _executor
+
+
+async def get_vision_image(data: bytes):
+    """Base64 JPEG of an attachment for the vision model, or None if it is too large"""
+    if not data:
+        return None
+
+    key = hashlib.sha256(data).hexdigest()
+    if key in _vision_cache:
+        _vision_cache.move_to_end(key)
+        return _vision_cache[key]
+
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(_get_executor(), prepare_vision_image, data)
+    _vision_cache[key] = result
+    if len(_vision_cache) > VISION_CACHE_SIZE:
+        _vision_cache.popitem(last=False)
+    return result
+
+
+def shutdown_image_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def decode_preview_frame(message: bytes):
+    """The image in a ComfyUI binary websocket frame, or None if it is not a preview.
+
+    The image is a memoryview into the frame, so nothing is copied until a
+    preview is actually encoded.
+    """
+    frame = memoryview(message)
+    if len(frame) < 8:
+        return None
+    (event,) = _FRAME_HEADER.unpack_from(frame)
+    if event == PREVIEW_IMAGE:
+        return frame[8:]
+    if event == PREVIEW_IMAGE_WITH_METADATA:
+        (metadata_length,) = _FRAME_HEADER.unpack_from(frame, 4)
+        return frame[8 + metadata_length:]
+    return None
+
+
+def preview_hash(image: Image.Image):
+    """Difference hash and mean brightness, which change little between similar frames"""
+    pixels = list(image.convert("L").resize((9, 8)).getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            value = (value << 1) | (left > pixels[row * 9 + column + 1])
+    return value, sum(pixels) // len(pixels)
+
+
+def _similar_previews(a, b):
+    return (
+        bin(a[0] ^ b[0]).count("1") < PREVIEW_HASH_DISTANCE
+        and abs(a[1] - b[1]) < PREVIEW_BRIGHTNESS_DISTANCE
+    )
+
+
+def encode_preview(frame, mode: PreviewMode, last_hash=None):
+    """Thumbnail a preview frame for a progress message.
+
+    Returns the frame's hash and the encoded thumbnail, or None in place of
+    the thumbnail if the frame looks the same as the one hashed last_hash.
+    Runs in a worker thread.
+    """
+    max_side, quality = PREVIEW_SIZES[mode]
+    with Image.open(io.BytesIO(frame)) as image:
+        image.draft("RGB", (max_side, max_side))
+        frame_hash = preview_hash(image)
+        if last_hash is not None and _similar_previews(frame_hash, last_hash):
+            return frame_hash, None
+
+        image.thumbnail((max_side, max_side))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        while True:
+            output = io.BytesIO()
+            image.save(output, format=PREVIEW_FORMAT, quality=quality)
+            if output.tell() <= MAX_PREVIEW_BYTES or quality <= MIN_PREVIEW_QUALITY:
+                break
+            quality = max(MIN_PREVIEW_QUALITY, quality // 2)
+    return frame_hash, output.getvalue()
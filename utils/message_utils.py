@@ -1,30 +1,66 @@
-import time
+import asyncio
+import io
 import math
 import discord
 import textwrap
+from api.model_db import get_guild_preview_mode
+from models.preview_mode import PreviewMode
 from models.sd_options import SDOptions
+from utils.discord_outbound import discord_outbound
+from utils.image_utils import encode_preview, PREVIEW_EXTENSION
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
 
 
 class ProgressMessenger:
-    last_update = time.time()
-    last_sent_image = None
+    """Shows a job's progress in a channel.
+
+    Progress edits go through the shared outbound scheduler, which paces and
+    coalesces them. Only the latest preview frame is thumbnailed, in a worker
+    thread, and frames that look like the one already shown are skipped.
+    Completion messages and deletes are sent as finals.
+    """
 
     def __init__(self, channel):
         self.channel = channel
         self.channel_message = None
+        guild = getattr(channel, "guild", None)
+        self.preview_mode = get_guild_preview_mode(guild.id if guild else None)
+        self.preview_frame = None
+        self.last_frame = None
+        self.last_hash = None
+        self.last_content = None
+
+    async def on_progress(self, percentage, frame):
+        self.preview_frame = frame
+        discord_outbound.submit_progress(self, self.channel.id, lambda: self._send_progress(percentage))
 
-    async def on_progress(self, percentage, image):
-            if time.time() - self.last_update >= 0.5:
-                files = []
-                if self.last_sent_image and self.last_sent_image != image:
-                    files.append(discord.File(image, filename="progress.jpg"))
+    async def _send_progress(self, percentage):
+        files = []
+        frame = self.preview_frame
+        if self.preview_mode != PreviewMode.OFF and frame is not None and frame is not self.last_frame:
+            self.last_frame = frame
+            try:
+                frame_hash, thumbnail = await asyncio.to_thread(
+                    encode_preview, frame, self.preview_mode, self.last_hash
+                )
+            except Exception as e:
+                logger.warning(f"Unable to encode preview: {e}")
+                thumbnail = None
+            if thumbnail is not None:
+                self.last_hash = frame_hash
+                files.append(discord.File(io.BytesIO(thumbnail), filename=f"progress.{PREVIEW_EXTENSION}"))
 
-                if self.channel_message is None:
-                    self.channel_message = await self.channel.send(self.format_progress(percentage), files=files)
-                else:
-                    await self.channel_message.edit(content=self.format_progress(percentage), files=files)
-                self.last_update = time.time()
-                self.last_sent_image = image
+        content = self.format_progress(percentage)
+        if self.channel_message is None:
+            self.channel_message = await self.channel.send(content, files=files)
+        elif files:
+            # Replace the previous preview rather than adding to it.
+            await self.channel_message.edit(content=content, files=files, attachments=[])
+        elif content != self.last_content:
+            await self.channel_message.edit(content=content)
+        self.last_content = content
 
     def format_progress(self, percentage):
         progress = math.floor(percentage * 10)
@@ -33,14 +69,20 @@ class ProgressMessenger:
         return complete + incomplete
 
     async def on_complete(self, message):
+        await discord_outbound.cancel_progress(self)
+
+        async def send():
             if self.channel_message is None:
                 self.channel_message = await self.channel.send(message)
             else:
                 await self.channel_message.edit(message)
 
+        await discord_outbound.send_final(self.channel.id, send)
+
     async def delete_message(self):
-         if self.channel_message:
-             await self.channel_message.delete()
+        await discord_outbound.cancel_progress(self)
+        if self.channel_message:
+            await discord_outbound.send_final(self.channel.id, self.channel_message.delete)
 
 def format_image_message(user, sd_options: SDOptions, job_id):
      return textwrap.dedent(